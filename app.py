@@ -1,17 +1,24 @@
-from flask import Flask, session, redirect, request, url_for, render_template
+from flask import Flask, redirect, request, url_for, render_template, abort, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from sqlalchemy import desc, cast, case
-import requests
+from sqlalchemy import desc, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import os
+import json
+import time
 from dotenv import load_dotenv
 from urllib.parse import urlencode
-from apscheduler.schedulers.background import BackgroundScheduler
+from datetime import datetime, timedelta
+from werkzeug.http import is_resource_modified
 import re
-import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import data
 import model
 import graphs
+import graph_cache
+import spotify
 
 load_dotenv()
 
@@ -23,20 +30,23 @@ secret_key = 'aaaaaaaaaaaaaaaa'
 redirect_uri=os.getenv('REDIRECT_URI_PROD')
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///playlists.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{data.DB_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 cors = CORS(app)
 app.config['CORS_HEADERS'] = 'Content-Type'
 app.secret_key = secret_key
+app.jinja_env.globals['plotlyjs_url'] = graphs.PLOTLYJS_URL
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
 
 class Playlist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    playlist_id = db.Column(db.String(50), nullable=False)
+    playlist_id = db.Column(db.String(50), nullable=False, unique=True, index=True)
     name = db.Column(db.String, nullable=False)
     url = db.Column(db.String)
     image = db.Column(db.String)
+    snapshot_id = db.Column(db.String)
+    number = db.Column(db.Integer, index=True)
 
     tracks = db.relationship('Track', secondary='tracklist', back_populates='playlists')
 
@@ -44,8 +54,8 @@ class Playlist(db.Model):
         return f"<{self.name}>"
 
 class Track(db.Model):
-    id = db.Column(db.Integer, primary_key=True, auto_increment=True)
-    track_id = db.Column(db.String(50), nullable=False)
+    id = db.Column(db.Integer, primary_key=True)
+    track_id = db.Column(db.String(50), nullable=False, unique=True, index=True)
     name = db.Column(db.String(100), nullable=False)
     artist = db.Column(db.String(100), nullable=False)
     danceability = db.Column(db.Float)
@@ -77,13 +87,55 @@ class Artist(db.Model):
     def __repr__(self):
         return f"<{self.name}"
 
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.String)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)
+    result = db.Column(db.String)
+    worker = db.Column(db.String)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'payload': self.payload,
+            'status': self.status,
+            'result': self.result,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f"<{self.kind} {self.status}>"
+
+class Recommendation(db.Model):
+    # written by model.build_recs(), one row per playlist and neighbor rank
+    id = db.Column(db.Integer, primary_key=True)
+    playlist_id = db.Column(db.String(50), nullable=False, index=True)
+    rank = db.Column(db.Integer, nullable=False)
+    neighbor_id = db.Column(db.String(50), nullable=False)
+    score = db.Column(db.Float)
+    version = db.Column(db.BigInteger, nullable=False, index=True)
+
+class DataVersion(db.Model):
+    # single row, bumped by ingestion whenever playlists or tracklists change
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
 tracklist = db.Table('tracklist',
     db.Column('id', db.Integer, primary_key=True),
-    db.Column('track_id', db.String(50), db.ForeignKey('track.track_id')),
-    db.Column('playlist_id', db.String(50), db.ForeignKey('playlist.playlist_id'))
+    db.Column('track_id', db.String(50), db.ForeignKey('track.track_id'), index=True),
+    db.Column('playlist_id', db.String(50), db.ForeignKey('playlist.playlist_id')),
+    db.Index('uq_tracklist_playlist_id_track_id', 'playlist_id', 'track_id', unique=True)
 )
 
 with app.app_context():
+    event.listen(db.engine, 'connect', lambda connection, record: data.configure_connection(connection))
     # db.drop_all()
     db.create_all()
     db.session.commit()
@@ -92,30 +144,113 @@ with app.app_context():
 def flatten(lst):
     return [item for sublist in lst for item in sublist]
 
+@lru_cache(maxsize=256)
+def get_playlist_tracks(playlist_id, version):
+    return tuple(
+        db.session.query(Track.track_id, Track.name, Track.artist, Track.artist_id)
+        .join(tracklist, tracklist.c.track_id == Track.track_id)
+        .filter(tracklist.c.playlist_id == playlist_id)
+        .order_by(tracklist.c.id)
+        .all()
+    )
+
+def data_version():
+    return db.session.execute(db.select(DataVersion.version).where(DataVersion.id == 1)).scalar() or 0
+
+def bump_data_version():
+    db.session.execute(
+        sqlite_insert(DataVersion).values(id=1, version=1)
+        .on_conflict_do_update(index_elements=['id'], set_={'version': DataVersion.version + 1})
+    )
+    db.session.commit()
+
+def playlist_number(playlist):
+    return playlist.number or 0
+
+def name_number(name):
+    # same value as SQLite's CAST(name AS INTEGER), stored as the sort key
+    match = re.match(r'\s*([+-]?\d+)', name)
+    return int(match.group(1)) if match else 0
+
+INDEX_PAGE_SIZE = 48
+
+def parse_cursor(cursor):
+    try:
+        number, id = cursor.split(':')
+        return int(number), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+@lru_cache(maxsize=64)
+def index_page(after, version):
+    # one rendered page of the homepage grid, newest number first, continuing
+    # after the (number, id) of the previous page's last playlist
+    query = Playlist.query.order_by(desc(Playlist.number), desc(Playlist.id))
+    if after is not None:
+        query = query.filter(db.tuple_(Playlist.number, Playlist.id) < after)
+    playlists = query.limit(INDEX_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(playlists) > INDEX_PAGE_SIZE:
+        playlists = playlists[:INDEX_PAGE_SIZE]
+        next_cursor = f"{playlists[-1].number}:{playlists[-1].id}"
+    return render_template('index_page.html', playlists=playlists, next_cursor=next_cursor)
+
 def model_playlists(playlist_id):
     recs = model.get_recs(playlist_id=playlist_id)
-    model_playlists=[]
-    for playlist_name in recs:
-        playlist = Playlist.query.filter_by(name=playlist_name).first()
-        model_playlists.append(playlist)
-    sorted_playlists = sorted(model_playlists, key=lambda p: int(p.name.split()[0]), reverse=True)
+    model_playlists = Playlist.query.filter(Playlist.playlist_id.in_(recs)).all()
+    sorted_playlists = sorted(model_playlists, key=playlist_number, reverse=True)
     return sorted_playlists
 
-def make_graphs(playlist_id, viewport):
-    playlist = Playlist.query.filter_by(playlist_id=playlist_id).first_or_404()
-    recs = model_playlists(playlist_id)
-    audio_graph = graphs.spider_graph(playlist, recs, viewport)
-    genre_graph = graphs.genres_graph(playlist, recs, viewport)
-    return audio_graph, genre_graph
+def make_graphs(playlist, recs, viewport):
+    version = rec_version()
+    def render():
+        if graph_cache.viewport_bucket(viewport) == 'mobile':
+            paths = graph_cache.image_paths(playlist.playlist_id, version)
+            if not all(os.path.exists(path) for path in paths):
+                graphs.write_mobile_graphs((playlist, recs, paths))
+            return [url_for('static', filename=filename) for filename in graph_cache.image_files(playlist.playlist_id, version)]
+        audio_graph = graphs.spider_graph(playlist, recs)
+        genre_graph = graphs.genres_graph(playlist, recs)
+        return audio_graph, genre_graph
+    return graph_cache.get_graphs(playlist.playlist_id, version, viewport, render)
+
+def prerender_mobile_graphs(version):
+    # only playlists whose graph inputs changed are rendered again, the rest
+    # reuse the previous version's images
+    rows = db.session.query(Playlist.playlist_id, Playlist.name, Playlist.number).all()
+    playlists = {row.playlist_id: graphs.PlaylistRef(row.playlist_id, row.name) for row in rows}
+    numbers = {row.playlist_id: row.number or 0 for row in rows}
+    previous = graph_cache.previous_version(version)
+    previous_manifest = graph_cache.read_manifest(previous)
+    manifest = {}
+    jobs = []
+    for playlist in playlists.values():
+        recs = [playlists[rec] for rec in model.get_recs(playlist.playlist_id) if rec in playlists]
+        recs = sorted(recs, key=lambda rec: numbers[rec.playlist_id], reverse=True)
+        signature = graphs.graph_signature(playlist, recs)
+        manifest[playlist.playlist_id] = signature
+        if previous_manifest.get(playlist.playlist_id) == signature and graph_cache.reuse_images(playlist.playlist_id, previous, version):
+            continue
+        jobs.append((playlist, recs, graph_cache.image_paths(playlist.playlist_id, version)))
+    rendered = 0
+    if jobs:
+        with ProcessPoolExecutor() as executor:
+            rendered = sum(executor.map(graphs.write_mobile_graphs, jobs))
+    graph_cache.write_manifest(version, manifest)
+    print(f"pre-rendered {rendered}/{len(jobs)} mobile graphs, reused {len(playlists) - len(jobs)}")
+    return rendered
+
+def rebuild_recs():
+    version = model.build_recs()
+    prerender_mobile_graphs(version)
+    graph_cache.invalidate(keep_version=version)
+    return version
 
 @app.route('/', methods=['POST', 'GET'])
 def index():
-    playlists = Playlist.query.order_by(desc(cast(Playlist.name, db.Integer))).all()
-    # tracks = Track.query.all()
-    if playlists:
-        return render_template('index.html', playlists=playlists)
-    else:
-        return render_template('index.html', playlists=None, tracks=None)
+    after = parse_cursor(request.args.get('after'))
+    page = index_page(after, data_version())
+    return render_template('index.html', page=page)
     
 @app.route('/about')
 def about():
@@ -124,45 +259,82 @@ def about():
 @app.route('/playlist/<string:playlist_id>', methods=['POST', 'GET'])
 def playlist_details(playlist_id):
     playlist = Playlist.query.filter_by(playlist_id=playlist_id).first_or_404()
-    track_ids = [
-        track_id[0]
-        for track_id in db.session.query(tracklist.c.track_id)
-        .filter_by(playlist_id=playlist_id)
-        .order_by(tracklist.c.id)
-        .all()
-    ]
-    order_cases = case(
-        *( (Track.track_id == track_id, index) for index, track_id in enumerate(track_ids) )
-    )
-    playlist_tracks = (
-        db.session.query(Track)
-        .filter(Track.track_id.in_(track_ids))
-        .order_by(order_cases)
-    )
+    playlist_tracks = get_playlist_tracks(playlist_id, data_version())
     sorted_playlists = model_playlists(playlist_id)
     viewport = request.args.get('width', type=int)
-    graphs = make_graphs(playlist_id, viewport)
+    graphs = make_graphs(playlist, sorted_playlists, viewport)
     return render_template('playlist.html', playlist=playlist, playlist_tracks=playlist_tracks, model_playlists=sorted_playlists, graphs=graphs, viewport=viewport)
 
+MAX_REC_IDS = 100
+REC_MAX_AGE = 60
+
+@app.route('/recommendations')
+def recommendations():
+    # ?id=a&id=b or ?id=a,b; cached by clients until the next rebuild or
+    # ingest, which can rename playlists
+    playlist_ids = list(dict.fromkeys(
+        playlist_id for value in request.args.getlist('id') for playlist_id in value.split(',') if playlist_id
+    ))
+    if not playlist_ids or len(playlist_ids) > MAX_REC_IDS:
+        abort(400)
+    k = max(1, min(request.args.get('k', default=model.NUM_RECS, type=int), model.NUM_RECS))
+
+    version = rec_version()
+    etag = f"recs-{version}-{data_version()}"
+    if version is not None and not is_resource_modified(request.environ, etag=etag):
+        response = app.response_class(status=304)
+    else:
+        recs = model.get_scored_recs(playlist_ids, k)
+        neighbor_ids = {neighbor_id for neighbors in recs.values() for neighbor_id, score in neighbors}
+        names = dict(
+            db.session.query(Playlist.playlist_id, Playlist.name)
+            .filter(Playlist.playlist_id.in_(neighbor_ids | set(playlist_ids)))
+            .all()
+        )
+        response = jsonify({
+            'version': version,
+            'recommendations': [
+                {
+                    'playlist_id': playlist_id,
+                    'name': names.get(playlist_id),
+                    'neighbors': [
+                        {'playlist_id': neighbor_id, 'name': names.get(neighbor_id), 'score': float(score)}
+                        for neighbor_id, score in recs[playlist_id]
+                    ],
+                }
+                for playlist_id in playlist_ids
+            ],
+        })
+    if version is None:
+        response.cache_control.no_store = True
+        return response
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = REC_MAX_AGE
+    return response
+
 @app.route('/artist/<string:artist_id>')
 def artist_playlists(artist_id):
-    artist_name = db.session.query(Artist.name).filter_by(artist_id=artist_id).first().name
-    tracks = db.session.query(Track).filter_by(artist_id=artist_id).all()
-    artist_playlists = []
-    for track in tracks:
-        playlist_id = db.session.query(tracklist.c.playlist_id).filter_by(track_id=track.track_id).first().playlist_id
-        playlists = db.session.query(Playlist).filter_by(playlist_id=playlist_id).all()
-        artist_playlists.append(playlists)
-    sorted_playlists = sorted(
-        artist_playlists,
-        key=lambda p: int(p[0].name.split(' ')[0]) if p[0].name.split(' ')[0].isdigit() else 0,
-        reverse=True
+    rows = (
+        db.session.query(Artist.name, Playlist)
+        .select_from(Artist)
+        .outerjoin(Track, Track.artist_id == Artist.artist_id)
+        .outerjoin(tracklist, tracklist.c.track_id == Track.track_id)
+        .outerjoin(Playlist, Playlist.playlist_id == tracklist.c.playlist_id)
+        .filter(Artist.artist_id == artist_id)
+        .distinct()
+        .order_by(desc(Playlist.number))
+        .all()
     )
-    return render_template('artist.html', artist_playlists=sorted_playlists, artist_name=artist_name)
+    if not rows:
+        abort(404)
+    artist_name = rows[0].name
+    artist_playlists = [playlist for name, playlist in rows if playlist is not None]
+    return render_template('artist.html', artist_playlists=artist_playlists, artist_name=artist_name)
 
 @app.route('/authorize')
 def authorize():
-    auth_url = "https://accounts.spotify.com/authorize/"
+    auth_url = f"{spotify.ACCOUNTS_URL}/authorize/"
     params = {
         'client_id': client_id,
         'response_type': 'code',
@@ -176,7 +348,7 @@ def authorize():
 def callback():
     auth_code = request.args.get('code')
     if auth_code:
-        token_url = 'https://accounts.spotify.com/api/token'
+        token_url = f"{spotify.ACCOUNTS_URL}/api/token"
         token_data = {
             'grant_type': 'authorization_code',
             'code': auth_code,
@@ -184,45 +356,13 @@ def callback():
             'client_id': client_id,
             'client_secret': client_secret,
         }
-        response = requests.post(token_url, data=token_data)
-        tokens = response.json()
-        access_token = tokens['access_token']
-        refresh_token = tokens['refresh_token']
-
-        session['access_token'] = access_token
-        session['refresh_token'] = refresh_token
-        session.modified = True
-
-        updated = update()
+        response = spotify.post(token_url, data=token_data)
+        spotify.set_tokens(response.json())
 
-        if updated:
-            print('loaded dbs')
-            return redirect(url_for('index'))
+        enqueue_job('ingest')
+        return redirect(url_for('index'))
     return redirect(url_for('authorize'))       
 
-def refresh_access_token():
-    url = "https://api.spotify.com/v1/me"
-    access_token = session.get('access_token')
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-    response = requests.get(url, headers=headers)
-    if response.status_code == 401:
-        refresh_token = session.get('refresh_token')
-        if refresh_token:
-            token_url = "https://accounts.spotify.com/api/token"
-            token_data = {
-                'grant_type': 'refresh_token',
-                'refresh_token': refresh_token,
-                'client_id': client_id,
-                'client_secret': client_secret,
-            }
-            response = requests.post(token_url, data=token_data)
-            access_token = response.json().get('access_token')
-            return access_token
-        return None
-    return access_token
-
 def batch(lst, n):
     for i in range(0, len(lst), n):
         if len(lst) >= (i+n):
@@ -230,37 +370,43 @@ def batch(lst, n):
         else:
             yield lst[i:]
 
-def add_track_to_playlist(playlist_id, track_id):
-    playlist = Playlist.query.filter_by(playlist_id=playlist_id).first()
-    track = Track.query.filter_by(track_id=track_id).first()
+def ingest_artists(artists):
+    try:
+        for rows in batch(list(artists), 500):
+            db.session.execute(sqlite_insert(Artist).values(rows).on_conflict_do_nothing(index_elements=['artist_id']))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return
 
-    exists = db.session.query(tracklist).filter_by(playlist_id=playlist_id, track_id=track_id).first()  
-    if playlist and track and exists==None:
-        playlist.tracks.append(track)
-    elif playlist:
-        print(f"Error on '{playlist.name}'")
-    db.session.commit()
+def ingest_playlist(playlist_id, tracks):
+    try:
+        for rows in batch(list(tracks), 500):
+            db.session.execute(sqlite_insert(Track).values(rows).on_conflict_do_nothing(index_elements=['track_id']))
+        tracklist_rows = [{'playlist_id': playlist_id, 'track_id': track['track_id']} for track in tracks]
+        for rows in batch(tracklist_rows, 500):
+            db.session.execute(sqlite_insert(tracklist).values(rows).on_conflict_do_nothing(index_elements=['playlist_id', 'track_id']))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
     return
 
 def get_playlists(num_playlists, limit=50):
-    access_token = refresh_access_token()
-    if access_token:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
+    if spotify.access_token():
+
+        def get_page(offset):
+            response = spotify.get('/me/playlists', params={'offset': offset, 'limit': limit})
+            return response.json()['items']
 
-        results = []
-        offset = 0
-        while offset < num_playlists:
-            playlists_url = f"https://api.spotify.com/v1/me/playlists?offset={offset}&limit={limit}"
-            response = requests.get(playlists_url, headers=headers)
-            playlists_data = response.json()
-            results.append(playlists_data['items'])
-            offset += 50
-            time.sleep(1)
+        results = spotify.fetch_all(get_page, range(0, num_playlists, limit))
         playlists_data = [playlist for result in results for playlist in result]
+        playlist_ids = [playlist['id'] for playlist in playlists_data]
+        existing_playlists = {playlist.playlist_id: playlist for playlist in Playlist.query.filter(Playlist.playlist_id.in_(playlist_ids))}
 
-        new_playlist_count=0
+        snapshots = {}
+        new_playlist_count = 0
         for playlist in playlists_data:
             reg = "^([0-9])+\s([a-z]+(\s?)([a-z]?))"
             zero_reg = "^00"
@@ -269,86 +415,179 @@ def get_playlists(num_playlists, limit=50):
                 playlist_id = playlist['id']
                 url = playlist['external_urls']['spotify']
                 image = playlist['images'][0]['url']
+                snapshot_id = playlist.get('snapshot_id')
 
-                existing_playlist = db.session.query(Playlist.playlist_id).filter_by(playlist_id=playlist_id).first()
                 image_reg = "^https:\/\/image-cdn-"
-                if not existing_playlist and re.match(image_reg, image) != None:
+                existing_playlist = existing_playlists.get(playlist_id)
+                if existing_playlist is None and re.match(image_reg, image) != None:
                     new_playlist = Playlist(
                         name=name,
+                        number=name_number(name),
                         playlist_id=playlist_id,
                         url=url,
                         image=image
                     )
                     db.session.add(new_playlist)
-                    db.session.commit()
-                    get_tracks(playlist_id)
-                    new_playlist_count+=1
-        print(new_playlist_count)
-        return new_playlist_count
+                    existing_playlists[playlist_id] = new_playlist
+                    snapshots[playlist_id] = snapshot_id
+                    new_playlist_count += 1
+                elif existing_playlist is not None and existing_playlist.snapshot_id != snapshot_id and playlist_id not in snapshots:
+                    existing_playlist.name = name
+                    existing_playlist.number = name_number(name)
+                    existing_playlist.url = url
+                    if re.match(image_reg, image) != None:
+                        existing_playlist.image = image
+                    snapshots[playlist_id] = snapshot_id
+        db.session.commit()
+
+        sync_playlists(snapshots)
+        print(f"{new_playlist_count} new, {len(snapshots) - new_playlist_count} changed")
+        return len(snapshots)
     return False
 
+def sync_playlists(snapshots):
+    # a playlist whose tracks failed to fetch keeps its old snapshot_id, so
+    # the next ingest tries it again; tracks are only kept for playlists that
+    # were admitted to the playlist table
+    known = [playlist_id for playlist_id, in db.session.query(Playlist.playlist_id).filter(Playlist.playlist_id.in_(list(snapshots)))]
+    synced = ingest_tracks(known)
+    for playlist in Playlist.query.filter(Playlist.playlist_id.in_(synced)):
+        playlist.snapshot_id = snapshots[playlist.playlist_id]
+    db.session.commit()
+    if snapshots:
+        bump_data_version()
+    return synced
+
 @app.route('/get/<string:playlist_id>')
 def get_playlist(playlist_id):
-    access_token = refresh_access_token()
-    if access_token:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
+    job = enqueue_job('playlist', playlist_id)
+    return jsonify(job.to_dict()), 202
 
-        playlist_url = f'https://api.spotify.com/v1/playlists/{playlist_id}'
-        response = requests.get(playlist_url, headers=headers)
+def sync_playlist(playlist_id):
+    if spotify.access_token():
+
+        playlist_url = f'/playlists/{playlist_id}'
+        response = spotify.get(playlist_url)
         playlist = response.json()
         name = playlist['name']
         playlist_id = playlist['id']
         url = playlist['external_urls']['spotify']
         image = playlist['images'][0]['url']
 
-        existing_playlist = db.session.query(Playlist.playlist_id).filter_by(playlist_id=playlist_id).first()
+        snapshot_id = playlist.get('snapshot_id')
+
+        existing_playlist = Playlist.query.filter_by(playlist_id=playlist_id).first()
         image_reg = "^https:\/\/image-cdn-ak"
         if not existing_playlist and re.match(image_reg, image) != None:
             new_playlist = Playlist(
                 name=name,
+                number=name_number(name),
                 playlist_id=playlist_id,
                 url=url,
                 image=image
             )
             db.session.add(new_playlist)
             db.session.commit()
-        get_tracks(playlist_id)
-        return redirect(url_for('index'))
+        elif not existing_playlist:
+            return 0
+        elif existing_playlist.snapshot_id != snapshot_id:
+            existing_playlist.name = name
+            existing_playlist.number = name_number(name)
+            existing_playlist.url = url
+            if re.match(image_reg, image) != None:
+                existing_playlist.image = image
+            db.session.commit()
+        else:
+            return 0
+        return len(sync_playlists({playlist_id: snapshot_id}))
     return False
 
-def get_tracks(playlist_id):
-    access_token = refresh_access_token()
-    print(access_token)
-    if access_token:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
+def tracks_url(playlist_id):
+    return f"/playlists/{playlist_id}/tracks?limit=100&fields=next%2Citems%28track%28name%2Cartists%28id%2Cname%29%2Cid%29%29"
+
+def ingest_tracks(playlist_ids, buffer_size=500):
+    pending = {}
+    pending_count = 0
+    fetched = {playlist_id: [] for playlist_id in playlist_ids}
+    errors = {}
+    for playlist_id, items in spotify.paginate_all({playlist_id: tracks_url(playlist_id) for playlist_id in playlist_ids}, errors):
+        tracks = parse_tracks(items)
+        fetched[playlist_id].extend(track['track_id'] for track in tracks)
+        pending.setdefault(playlist_id, []).extend(tracks)
+        pending_count += len(tracks)
+        if pending_count >= buffer_size:
+            save_tracks(pending)
+            pending = {}
+            pending_count = 0
+    save_tracks(pending)
+    for playlist_id, error in errors.items():
+        print(f"Error fetching tracks for {playlist_id}: {error!r}")
+        del fetched[playlist_id]
+    for playlist_id, track_ids in fetched.items():
+        reconcile_tracklist(playlist_id, track_ids)
+        model.update_playlist(playlist_id)
+    return list(fetched)
+
+def reconcile_tracklist(playlist_id, track_ids):
+    # new tracks were appended by ingest_playlist; drop removed ones, and
+    # rewrite the playlist's rows only if the remaining order is off
+    rows = (
+        db.session.query(tracklist.c.id, tracklist.c.track_id)
+        .filter(tracklist.c.playlist_id == playlist_id)
+        .order_by(tracklist.c.id)
+        .all()
+    )
+    wanted = list(dict.fromkeys(track_ids))
+    current = [row.track_id for row in rows]
+    if current == wanted:
+        return
+    keep = set(wanted)
+    if [track_id for track_id in current if track_id in keep] == wanted:
+        stale = [row.id for row in rows if row.track_id not in keep]
+        for ids in batch(stale, 500):
+            db.session.execute(tracklist.delete().where(tracklist.c.id.in_(ids)))
+    else:
+        db.session.execute(tracklist.delete().where(tracklist.c.playlist_id == playlist_id))
+        tracklist_rows = [{'playlist_id': playlist_id, 'track_id': track_id} for track_id in wanted]
+        for rows in batch(tracklist_rows, 500):
+            db.session.execute(sqlite_insert(tracklist).values(rows))
+    db.session.commit()
+    return
 
-        tracks_url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks?fields=items%28track%28name%2C+artists%28id%2C+name%29%2C+id%29"
-        tracks_response = requests.get(tracks_url, headers=headers)
-        tracks_data = tracks_response.json().get('items', [])
-
-        for track_info in tracks_data:
-            track = track_info['track']
-            track_id = track['id']
-            track_name = track['name']
-            artist_name = track['artists'][0]['name']
-            artist_id = track['artists'][0]['id']
-
-            existing_track = db.session.query(Track.track_id).filter_by(track_id=track_id).first()
-            if not existing_track and all([track, track_id, track_name, artist_name, artist_id]):
-                new_track = Track(
-                    track_id=track_id,
-                    name=track_name,
-                    artist=artist_name,
-                    artist_id=artist_id
-                )
-                get_artists(artist_id)
-                db.session.add(new_track)
-                db.session.commit()
-            add_track_to_playlist(playlist_id, track_id)
+def parse_tracks(items):
+    tracks = []
+    for track_info in items:
+        track = track_info['track']
+        if not track or not track['artists']:
+            continue
+        track_id = track['id']
+        track_name = track['name']
+        artist_name = track['artists'][0]['name']
+        artist_id = track['artists'][0]['id']
+        if all([track_id, track_name, artist_name, artist_id]):
+            tracks.append({
+                'track_id': track_id,
+                'name': track_name,
+                'artist': artist_name,
+                'artist_id': artist_id
+            })
+    return tracks
+
+def save_tracks(playlist_tracks):
+    tracks = [track for tracks in playlist_tracks.values() for track in tracks]
+    resolve_artists(tracks)
+    for playlist_id, tracks in playlist_tracks.items():
+        ingest_playlist(playlist_id, tracks)
+    return
+
+def resolve_artists(tracks):
+    artist_ids = list({track['artist_id'] for track in tracks})
+    existing_artists = set()
+    for ids in batch(artist_ids, 500):
+        existing_artists.update(row.artist_id for row in db.session.query(Artist.artist_id).filter(Artist.artist_id.in_(ids)))
+    missing_artists = [artist_id for artist_id in artist_ids if artist_id not in existing_artists]
+    results = spotify.fetch_all(get_artists, list(batch(missing_artists, 50)))
+    ingest_artists([artist for artists in results for artist in artists])
     return
 
 
@@ -388,72 +627,197 @@ def get_tracks(playlist_id):
 #         db.session.commit()
 #     return
 
-def get_audio_features(num_tracks):
-    track_ids = db.session.query(Track.track_id).order_by(Track.track_id.desc()).limit(num_tracks).all()
+AUDIO_FEATURES = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo']
+AUDIO_FEATURES_CHECKPOINT = 'instance/audio_features_checkpoint.json'
+
+def get_audio_features(track_id):
     headers = {
         'Accept': 'application/json',
     }
+    af_url = f"https://soundlens.pro/api/spotify-replacement/audio-features/{track_id}"
+    try:
+        af_metadata = spotify.get(af_url, headers=headers).json()
+        af_data = spotify.get(af_metadata['analysis_url']).json()
+        return {feature: af_data[feature] for feature in AUDIO_FEATURES}
+    except Exception as e:
+        print(f"Error on audio features for '{track_id}': {e}")
+        return None
 
-    for each in track_ids:
-        track_id = each[0]
-        print('track_id', track_id)
-        af_url = f"https://soundlens.pro/api/spotify-replacement/audio-features/{track_id}"
-        af_metadata = requests.get(af_url, headers=headers).json()
-        af_response = requests.get(af_metadata['analysis_url'])
-        af_data = af_response.json()
-        print('response', af_data)
-
-        spotify_id = af_data['id']
-        track = db.session.query(Track).filter_by(track_id=spotify_id).first()
-
-        track.danceability = af_data['danceability']
-        track.energy = af_data['energy']
-        track.key = af_data['key']
-        track.loudness = af_data['loudness']
-        track.mode = af_data['mode']
-        track.speechiness = af_data['speechiness']
-        track.acousticness = af_data['acousticness']
-        track.instrumentalness = af_data['instrumentalness']
-        track.liveness = af_data['liveness']
-        track.valence = af_data['valence']
-        track.tempo = af_data['tempo']
-    db.session.commit()
-    return
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+def write_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(checkpoint, file)
+    os.replace(tmp_path, path)
+
+def backfill_audio_features(limit=None, batch_size=100, checkpoint_path=AUDIO_FEATURES_CHECKPOINT):
+    # fills tracks with NULL features batch by batch; the checkpoint holds the
+    # last track_id handled so an interrupted run resumes after it, and is
+    # cleared once a pass completes so failed tracks are retried next time
+    checkpoint = read_checkpoint(checkpoint_path)
+    last_track_id = checkpoint.get('last_track_id', '')
+    started = time.time()
+    updated, errors = 0, 0
+    playlist_ids = set()
+
+    while limit is None or updated + errors < limit:
+        size = batch_size if limit is None else min(batch_size, limit - updated - errors)
+        rows = (
+            db.session.query(Track.id, Track.track_id)
+            .filter(Track.danceability.is_(None), Track.track_id > last_track_id)
+            .order_by(Track.track_id)
+            .limit(size)
+            .all()
+        )
+        if not rows:
+            checkpoint = {}
+            break
+
+        results = spotify.fetch_all(get_audio_features, [row.track_id for row in rows])
+        features = [dict(id=row.id, **result) for row, result in zip(rows, results) if result]
+        if features:
+            db.session.execute(db.update(Track), features)
+            track_ids = [row.track_id for row, result in zip(rows, results) if result]
+            playlist_ids.update(
+                row.playlist_id for row in
+                db.session.query(tracklist.c.playlist_id).filter(tracklist.c.track_id.in_(track_ids)).distinct()
+            )
+        db.session.commit()
 
-def get_artists(artist_id):
-    access_token = refresh_access_token()
-    if access_token:
-        headers = {
-            'Authorization': f'Bearer {access_token}',
+        updated += len(features)
+        errors += len(rows) - len(features)
+        last_track_id = rows[-1].track_id
+        checkpoint = {'last_track_id': last_track_id, 'updated': checkpoint.get('updated', 0) + len(features), 'errors': checkpoint.get('errors', 0) + len(rows) - len(features)}
+        write_checkpoint(checkpoint_path, checkpoint)
+        elapsed = time.time() - started
+        print(f"audio features: {updated} updated, {errors} errors, {updated / elapsed:.1f} tracks/s")
+
+    if not checkpoint and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    for playlist_id in playlist_ids:
+        model.update_playlist(playlist_id)
+    elapsed = time.time() - started
+    return {'updated': updated, 'errors': errors, 'seconds': elapsed, 'tracks_per_second': updated / elapsed if elapsed else 0}
+
+def get_artists(artist_ids):
+    artists_url = "/artists"
+    artists_response = spotify.get(artists_url, params={'ids': ','.join(artist_ids)})
+    artists_data = artists_response.json().get('artists', [])
+    return [
+        {
+            'artist_id': artist_data['id'],
+            'name': artist_data['name'],
+            'genres': ", ".join(artist_data['genres'])
         }
+        for artist_data in artists_data if artist_data
+    ]
 
-        existing_artist = db.session.query(Artist.artist_id).filter_by(artist_id=artist_id).first()
-        if not existing_artist:
-            artist_url = f"https://api.spotify.com/v1/artists/{artist_id}"
-            artist_response = requests.get(artist_url, headers=headers)
-            artist_data = artist_response.json()
+# job queue: web routes only enqueue, worker.py claims and runs the stages
+# ingest -> backfill -> rebuild one at a time
+JOB_TIMEOUT = timedelta(hours=2)
 
-            new_artist = Artist(
-                artist_id=artist_id,
-                name=artist_data['name'],
-                genres=", ".join(artist_data['genres'])
-            )
-            db.session.add(new_artist)
+def enqueue_job(kind, payload=None):
+    job = Job.query.filter_by(kind=kind, payload=payload, status='queued').first()
+    if job is None:
+        job = Job(kind=kind, payload=payload)
+        db.session.add(job)
         db.session.commit()
-    return
+    return job
+
+def request_rebuild():
+    # after a failed rebuild, wait JOB_TIMEOUT before pages ask for another
+    pending = Job.query.filter(
+        Job.kind == 'rebuild',
+        db.or_(
+            Job.status.in_(['queued', 'running']),
+            db.and_(Job.status == 'failed', Job.finished_at > datetime.utcnow() - JOB_TIMEOUT),
+        ),
+    ).first()
+    if pending is None:
+        enqueue_job('rebuild')
+
+def rec_version():
+    # recommendations are only built by the worker; until the first rebuild
+    # pages are served without them
+    version = model.rec_version()
+    if version is None:
+        request_rebuild()
+    return version
+
+def claim_job(worker):
+    next_job = db.select(Job.id).where(Job.status == 'queued').order_by(Job.id).limit(1).scalar_subquery()
+    claimed = db.session.execute(
+        db.update(Job)
+        .where(Job.id == next_job, Job.status == 'queued')
+        .values(status='running', worker=worker, started_at=datetime.utcnow())
+        .returning(Job.id)
+    ).first()
+    db.session.commit()
+    return db.session.get(Job, claimed.id) if claimed else None
+
+def requeue_stale_jobs():
+    stale = Job.query.filter(Job.status == 'running', Job.started_at < datetime.utcnow() - JOB_TIMEOUT).all()
+    for job in stale:
+        job.status = 'queued'
+        job.worker = None
+    db.session.commit()
+    return len(stale)
+
+def run_ingest(job):
+    num_playlists = get_playlists(20, 20)
+    if num_playlists:
+        enqueue_job('backfill')
+    return num_playlists
+
+def run_playlist(job):
+    synced = sync_playlist(job.payload)
+    if synced:
+        enqueue_job('backfill')
+    return synced
+
+def run_backfill(job):
+    stats = backfill_audio_features()
+    enqueue_job('rebuild')
+    return stats
+
+def run_rebuild(job):
+    return rebuild_recs()
+
+JOB_STAGES = {
+    'ingest': run_ingest,
+    'playlist': run_playlist,
+    'backfill': run_backfill,
+    'rebuild': run_rebuild,
+}
+
+def run_job(job):
+    try:
+        result = JOB_STAGES[job.kind](job)
+        job.status = 'done'
+        job.result = json.dumps(result, default=str)
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.result = repr(e)
+        print(f"Error on job {job.id} '{job.kind}': {e!r}")
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
 
 @app.route('/update')
 def update():
-    model.update_similarities()
-    print('got here')
-    num_playlists = get_playlists(20, 20)
-    print(num_playlists)
-    # get_audio_features(100)
-    return redirect(url_for('index'))
+    job = enqueue_job('ingest')
+    return jsonify(job.to_dict()), 202
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(update, 'interval', days=1)
-scheduler.start()
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = db.get_or_404(Job, job_id)
+    return jsonify(job.to_dict())
 
 if __name__ == "__main__":
     port = int(os.environ.get('PORT', 5000))
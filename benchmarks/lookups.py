@@ -0,0 +1,46 @@
+# mean time of the point lookups the lookup indexes serve, on a generated
+# database; --without-indexes drops them first for a before/after comparison:
+#
+#   python benchmarks/lookups.py [--without-indexes] [runs]
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import sample_db
+
+LOOKUP_INDEXES = ['ix_track_track_id', 'ix_playlist_playlist_id', 'uq_tracklist_playlist_id_track_id',
+                  'ix_tracklist_track_id', 'ix_playlist_number']
+
+LOOKUPS = [
+    ('track by track_id', "SELECT * FROM track WHERE track_id = ?", lambda rng: (f't{rng.randrange(100000)}',)),
+    ('playlist by playlist_id', "SELECT * FROM playlist WHERE playlist_id = ?", lambda rng: (f'p{rng.randrange(3000)}',)),
+    ('tracklist pair exists', "SELECT 1 FROM tracklist WHERE playlist_id = ? AND track_id = ?",
+     lambda rng: (f'p{rng.randrange(3000)}', f't{rng.randrange(100000)}')),
+    ('tracklist by track_id', "SELECT playlist_id FROM tracklist WHERE track_id = ?", lambda rng: (f't{rng.randrange(100000)}',)),
+    ('index page, first 48 rows', "SELECT * FROM playlist ORDER BY number DESC, id DESC LIMIT 48", lambda rng: ()),
+]
+
+
+def run(db, runs):
+    rng = random.Random(1)
+    for label, query, params in LOOKUPS:
+        arguments = [params(rng) for _ in range(runs)]
+        started = time.perf_counter()
+        for argument in arguments:
+            db.execute(query, argument).fetchall()
+        print(f'{label:<28} {(time.perf_counter() - started) / runs * 1e6:8.0f} us')
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    runs = int(args[0]) if args else 200
+    path = sample_db.build(os.path.join(tempfile.mkdtemp(), 'lookups.db'), 3000, 100000, 3000)
+    db = sqlite3.connect(path)
+    if '--without-indexes' in sys.argv:
+        for index in LOOKUP_INDEXES:
+            db.execute(f"DROP INDEX {index}")
+    print(f"100k tracks / 3k playlists, mean of {runs} runs{', without lookup indexes' if '--without-indexes' in sys.argv else ''}:")
+    run(db, runs)
@@ -0,0 +1,50 @@
+# builds a playlists database of a given size for the benchmarks:
+#
+#   python benchmarks/sample_db.py /tmp/bench.db 3000 100000 3000
+import os
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GENRES = ['pop', 'rock', 'indie pop', 'art pop', 'shoegaze', 'dream pop', 'hip hop', 'trap', 'jazz',
+          'bossa nova', 'k-pop', 'techno', 'house', 'ambient', 'folk', 'emo', 'bedroom pop', 'city pop']
+FEATURES = ['danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+            'instrumentalness', 'liveness', 'valence', 'tempo']
+
+
+def build(path, num_artists=3000, num_tracks=100000, num_playlists=3000, seed=0):
+    if os.path.exists(path):
+        os.remove(path)
+    # the app creates its schema on import
+    os.environ['PLAYLISTS_DB'] = os.path.abspath(path)
+    import app
+
+    rng = random.Random(seed)
+    db = sqlite3.connect(path)
+    db.executemany(
+        "INSERT INTO artist (artist_id, name, genres) VALUES (?, ?, ?)",
+        ((f'a{i}', f'Artist {i}', ', '.join(rng.sample(GENRES, rng.randint(0, 3)))) for i in range(num_artists))
+    )
+    db.executemany(
+        f"INSERT INTO track (track_id, name, artist, artist_id, {', '.join(FEATURES)}) VALUES ({', '.join('?' * (4 + len(FEATURES)))})",
+        ([f't{i}', f'Track {i}', 'x', f'a{rng.randrange(num_artists)}'] + [rng.random() for _ in FEATURES] for i in range(num_tracks))
+    )
+    db.executemany(
+        "INSERT INTO playlist (playlist_id, name, number, url, image) VALUES (?, ?, ?, ?, ?)",
+        ((f'p{i}', f'{i + 1} some name', i + 1, 'u', 'i') for i in range(num_playlists))
+    )
+    db.executemany(
+        "INSERT INTO tracklist (playlist_id, track_id) VALUES (?, ?)",
+        ((f'p{p}', f't{t}') for p in range(num_playlists) for t in rng.sample(range(num_tracks), rng.randint(10, 40)))
+    )
+    db.commit()
+    db.close()
+    return path
+
+
+if __name__ == '__main__':
+    path = sys.argv[1]
+    build(path, *(int(arg) for arg in sys.argv[2:5]))
+    print(f'built {path}')
@@ -0,0 +1,36 @@
+# time `import app` in fresh processes with the third-party libraries already
+# imported, so only the app's own start-up work is measured:
+#
+#   python benchmarks/startup.py [runs] [artists tracks playlists]
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import time
+import pandas, numpy, scipy.sparse, scipy.spatial, sklearn.decomposition
+import plotly.graph_objects, plotly.io, plotly.offline, flask, flask_cors, flask_sqlalchemy, flask_migrate, requests, dotenv
+started = time.perf_counter()
+import app
+print((time.perf_counter() - started) * 1000)
+"""
+
+
+def import_time(path):
+    env = dict(os.environ, PLAYLISTS_DB=path)
+    result = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    size = [sys.argv[2], sys.argv[3], sys.argv[4]] if len(sys.argv) > 4 else ['3000', '100000', '3000']
+    path = os.path.join(tempfile.mkdtemp(), 'startup.db')
+    subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'sample_db.py'), path] + size, check=True, capture_output=True)
+    times = [import_time(path) for _ in range(runs)]
+    print(f"import app, {'/'.join(size)} artists/tracks/playlists: "
+          f"median {statistics.median(times):.0f} ms, min {min(times):.0f} ms over {runs} runs")
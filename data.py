@@ -0,0 +1,23 @@
+import os
+import sqlite3
+import threading
+
+DB_PATH = os.getenv('PLAYLISTS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'playlists.db'))
+BUSY_TIMEOUT = 30000
+
+_local = threading.local()
+
+def configure_connection(db):
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT}")
+
+def connection():
+    # one connection per thread, reopened after a fork
+    db = getattr(_local, 'db', None)
+    if db is None or _local.pid != os.getpid():
+        db = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT / 1000)
+        configure_connection(db)
+        _local.db = db
+        _local.pid = os.getpid()
+    return db
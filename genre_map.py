@@ -0,0 +1,44 @@
+import json
+import os
+import pandas as pd
+from bs4 import BeautifulSoup
+
+SOURCE_PATH = 'resources/enao.html'
+GENRE_MAP_PATH = 'resources/genre_map.json'
+
+def parse_enao(path=SOURCE_PATH):
+    with open(path, 'r', encoding='utf-8') as file:
+        html_content = file.read()
+    soup = BeautifulSoup(html_content, 'html.parser')
+
+    genres = soup.find(class_='canvas')
+    genre_map = {}
+    for genre in genres.find_all(recursive=True):
+        name = genre.text[:-2]
+        style = genre.get('style', '')
+        styles = dict(item.split(':') for item in style.split(';') if item.strip())
+        top = styles.get(' top', '').strip()
+        left = styles.get(' left', '').strip()
+        color = styles.get('color', '').strip()
+        genre_map[name] = [top, left, color]
+    genre_map = {k: v for k, v in genre_map.items() if not k == ''}
+    return {genre: [int(values[0][:-2]), int(values[1][:-2]), values[2]] for genre, values in genre_map.items()}
+
+def compile_genre_map(source=SOURCE_PATH, path=GENRE_MAP_PATH):
+    genre_map = parse_enao(source)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(genre_map, file, ensure_ascii=False, separators=(',', ':'))
+    return genre_map
+
+def load_genre_map(path=GENRE_MAP_PATH):
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            genre_map = json.load(file)
+    else:
+        genre_map = compile_genre_map(path=path)
+    genre_data = [{'genre': genre, 'x': x, 'y': y, 'color': color} for genre, (x, y, color) in genre_map.items()]
+    return pd.DataFrame(genre_data, columns=['genre', 'x', 'y', 'color'])
+
+if __name__ == "__main__":
+    genre_map = compile_genre_map()
+    print(f"compiled {len(genre_map)} genres to {GENRE_MAP_PATH}")
@@ -0,0 +1,111 @@
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+CACHE_DIR = 'instance/graph_cache'
+STATIC_DIR = 'static'
+IMAGE_DIR = 'graphs'
+CACHE_BYTES = 64 * 1024 * 1024
+MOBILE_WIDTH = 768
+
+# LRU of rendered graphs, bounded by the total length of their strings
+_cache = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+def viewport_bucket(viewport):
+    return 'mobile' if viewport < MOBILE_WIDTH else 'desktop'
+
+def cache_path(playlist_id, version, bucket):
+    return os.path.join(CACHE_DIR, str(version), f"{playlist_id}-{bucket}.json")
+
+def image_files(playlist_id, version):
+    return [f"{IMAGE_DIR}/{version}/{playlist_id}-{graph}.jpg" for graph in ('audio', 'genre')]
+
+def image_paths(playlist_id, version):
+    return [os.path.join(STATIC_DIR, filename) for filename in image_files(playlist_id, version)]
+
+def manifest_path(version):
+    return os.path.join(CACHE_DIR, str(version), 'mobile.json')
+
+def read_manifest(version):
+    path = manifest_path(version)
+    if version is None or not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def write_manifest(version, manifest):
+    path = manifest_path(version)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file)
+
+def previous_version(version):
+    # newest pre-rendered version older than the given one
+    image_dir = os.path.join(STATIC_DIR, IMAGE_DIR)
+    if not os.path.isdir(image_dir):
+        return None
+    versions = [int(name) for name in os.listdir(image_dir) if name.isdigit() and int(name) < version]
+    return max(versions, default=None)
+
+def reuse_images(playlist_id, old_version, version):
+    old_paths = image_paths(playlist_id, old_version)
+    if not all(os.path.exists(path) for path in old_paths):
+        return False
+    for old_path, path in zip(old_paths, image_paths(playlist_id, version)):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            continue
+        try:
+            os.link(old_path, path)
+        except OSError:
+            shutil.copyfile(old_path, path)
+    return True
+
+def _remember(key, graphs):
+    global _cache_bytes
+    with _lock:
+        if key in _cache:
+            _cache_bytes -= sum(len(graph) for graph in _cache.pop(key))
+        _cache[key] = graphs
+        _cache_bytes += sum(len(graph) for graph in graphs)
+        while _cache_bytes > CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= sum(len(graph) for graph in evicted)
+
+def get_graphs(playlist_id, version, viewport, render):
+    bucket = viewport_bucket(viewport)
+    key = (playlist_id, version, bucket)
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    path = cache_path(playlist_id, version, bucket)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as file:
+            graphs = tuple(json.load(file))
+    else:
+        graphs = tuple(render())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(graphs, file)
+        os.replace(tmp_path, path)
+    _remember(key, graphs)
+    return graphs
+
+def invalidate(keep_version=None):
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
+    for cache_dir in (CACHE_DIR, os.path.join(STATIC_DIR, IMAGE_DIR)):
+        if not os.path.isdir(cache_dir):
+            continue
+        for version in os.listdir(cache_dir):
+            if version != str(keep_version):
+                shutil.rmtree(os.path.join(cache_dir, version), ignore_errors=True)
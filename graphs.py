@@ -1,48 +1,42 @@
 import pandas as pd
-import numpy as np
-import sqlite3
 import plotly.graph_objects as go
 import model
-from bs4 import BeautifulSoup
+import genre_map
 from scipy.spatial import ConvexHull
 import plotly.io as pio
-import base64
+from plotly.offline import get_plotlyjs_version
+import os
+import hashlib
+import json
+from collections import namedtuple
 
-db = sqlite3.connect('instance/playlists.db')
-artist = pd.read_sql_query("SELECT * FROM artist", db).set_index('id')
-playlist = pd.read_sql_query("SELECT * FROM playlist", db).set_index('id')
-track = pd.read_sql_query("SELECT * FROM track", db).set_index('id')
+# graphs are rendered without the plotly.js bundle; the page loads it once
+PLOTLYJS_URL = f"https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js"
 
 colorway = ['#173a89', '#ca6d0b', '#7484F9', '#047640', '#BDBEC4', '#9E310C']
 
+PlaylistRef = namedtuple('PlaylistRef', ['playlist_id', 'name'])
+
 def percent_width(percent, width):
     return percent * width
 
-def flatten(itr):
-        for x in itr:
-            try:
-                yield from flatten(x)
-            except:
-                yield x
+def render(fig, config=None):
+    return fig.to_html(full_html=False, include_plotlyjs=False, config=config)
 
-def spider_graph(playlist, recs, viewport):
-    features = model.get_audio_features()
-    # features.drop(['key', 'liveness'], axis=1, inplace=True)
+def spider_graph(playlist, recs):
+    fig = spider_figure(playlist, recs)
+    return render(fig, config={'responsive': True, 'displayModeBar': True})
 
-    columns = features.columns
-    for column in columns:
-        features[column] = features[column] / features[column].abs().max()
+def spider_figure(playlist, recs):
+    playlists = [playlist, *recs]
+    features = model.playlist_audio_features([playlist.playlist_id for playlist in playlists])
 
     fig = go.Figure()
 
-    playlists = [playlist]
-    playlists.append(recs)
-    playlists = flatten(playlists)
-    for playlist in playlists:
-        playlist_features = features.loc[features.index == playlist.playlist_id].values.flatten()
+    for playlist, playlist_features in zip(playlists, features):
         fig.add_trace(go.Scatterpolar(
             r = playlist_features,
-            theta = columns,
+            theta = model.AUDIO_FEATURES,
             fill = 'toself',
             name = playlist.name,
             mode = 'markers'
@@ -61,54 +55,41 @@ def spider_graph(playlist, recs, viewport):
         font_family="Sans-Serif",
         colorway=colorway
     )
+    return fig
+
+genre_df = genre_map.load_genre_map()
+genre_lookup = pd.Index(genre_df['genre'])
+genre_coords = genre_df[['x', 'y']].to_numpy(dtype=float)
+genre_centroid = genre_coords.mean(axis=0)
+
+def get_coords(genres):
+    positions = genre_lookup.get_indexer(genres)
+    coords = genre_coords[positions]
+    coords[positions == -1] = genre_centroid
+    return coords
 
-    if viewport < 768:
-        graph_bytes = pio.to_image(fig, format='jpg')
-        graph_image = base64.b64encode(graph_bytes).decode('utf-8')
-        return graph_image
-    else:
-        graph_html = fig.to_html(full_html=False, config={'responsive': True, 'displayModeBar': True})
-        return graph_html
+_genre_base = None
 
 def genres_scatter():
-    with open('resources/enao.html', 'r', encoding='utf-8') as file:
-        html_content = file.read()
-    soup = BeautifulSoup(html_content, 'html.parser')
-
-    genres = soup.find(class_='canvas')
-    genre_map = {}
-    for genre in genres.find_all(recursive=True):
-        name = genre.text[:-2]
-        style = genre.get('style', '')
-        styles = dict(item.split(':') for item in style.split(';') if item.strip())
-        top = styles.get(' top', '').strip()
-        left = styles.get(' left', '').strip()
-        color = styles.get('color', '').strip()
-        genre_map[name] = [top, left, color]
-    genre_map = {k: v for k, v in genre_map.items() if not k == ''}
-
-    genre_data = [{'genre': genre, 'x': int(values[0][:-2]), 'y': int(values[1][:-2]), 'color': values[2]}for genre, values in genre_map.items()]
-    genre_df = pd.DataFrame(genre_data)
-
-    def get_coords(genre):
-        try:
-            return genre_df[genre_df['genre'] == genre]['x'].values[0], genre_df[genre_df['genre'] == genre]['y'].values[0]
-        except:
-            return (sum(genre_df['x']) / len(genre_df), sum(genre_df['y']) / len(genre_df))
+    global _genre_base
+    if _genre_base is None:
+        _genre_base = genres_base()
+    return go.Figure(_genre_base)
 
+def genres_base():
     fig = go.Figure()
-    for item in genre_data:
-        fig.add_trace(
-            go.Scatter(
-                x=[item['x']],
-                y=[item['y']],
-                marker=dict(color=item['color'], size=5),
-                name=item['genre'],
-                opacity=0.5,
-                hovertemplate=item['genre'],
-                showlegend=False
-            )
+    fig.add_trace(
+        go.Scattergl(
+            x=genre_df['x'],
+            y=genre_df['y'],
+            mode='markers',
+            marker=dict(color=genre_df['color'], size=5),
+            text=genre_df['genre'],
+            opacity=0.5,
+            hovertemplate='%{text}<extra></extra>',
+            showlegend=False
         )
+    )
     fig.update_layout(
         title=dict(
             text='<b>genre</b>',
@@ -132,23 +113,21 @@ def genres_scatter():
         scaleanchor='x',
         scaleratio=10
     )
-    return fig, get_coords
+    return fig
 
-def genres_graph(playlist, recs, viewport):
-    all_playlist_genres = model.get_genres()
-    fig, get_coords = genres_scatter()
+def genres_graph(playlist, recs):
+    fig = genres_figure(playlist, recs)
+    return render(fig)
+
+def genres_figure(playlist, recs):
+    fig = genres_scatter()
 
-    playlists = [playlist]
-    playlists.append(recs)
-    playlists = flatten(playlists)
     position = 0
-    for this_playlist in playlists:
-        playlist_genres = list(set(all_playlist_genres[all_playlist_genres['playlist_id'] == this_playlist.playlist_id]['genres'].values[0]))
-        points = []
-        for genre in playlist_genres:
-            points.append(get_coords(genre))
+    for this_playlist in [playlist, *recs]:
+        playlist_genres = model.playlist_genres(this_playlist.playlist_id)
+        points = get_coords(playlist_genres)
         hull = ConvexHull(points)
-        shape = np.array(points)[hull.vertices]
+        shape = points[hull.vertices]
         shape = list(zip(*shape))
         
         fig.add_trace(
@@ -164,13 +143,37 @@ def genres_graph(playlist, recs, viewport):
             )
         )
         position += 1
-
-    if viewport < 768:
-        graph_bytes = pio.to_image(fig, format='jpg')
-        graph_image = base64.b64encode(graph_bytes).decode('utf-8')
-        return graph_image
-    else:
-        graph_html = fig.to_html(full_html=False)
-        return graph_html
+    return fig
+
+def mobile_graphs(playlist, recs):
+    audio_image = pio.to_image(spider_figure(playlist, recs), format='jpg')
+    genre_image = pio.to_image(genres_figure(playlist, recs), format='jpg')
+    return audio_image, genre_image
+
+def graph_signature(playlist, recs):
+    # everything the two graphs are drawn from; equal signatures mean the
+    # images from an earlier version can be reused
+    playlists = [playlist, *recs]
+    features = model.playlist_audio_features([playlist.playlist_id for playlist in playlists])
+    inputs = [
+        [playlist.playlist_id, playlist.name, playlist_features.tolist(), model.playlist_genres(playlist.playlist_id)]
+        for playlist, playlist_features in zip(playlists, features)
+    ]
+    return hashlib.sha1(json.dumps(inputs).encode()).hexdigest()
+
+def write_mobile_graphs(job):
+    playlist, recs, paths = job
+    try:
+        images = mobile_graphs(playlist, recs)
+    except Exception as e:
+        print(f"Error rendering '{playlist.name}': {e}")
+        return False
+    for image, path in zip(images, paths):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(image)
+        os.replace(tmp_path, path)
+    return True
 
 
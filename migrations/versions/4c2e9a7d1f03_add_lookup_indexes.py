@@ -0,0 +1,37 @@
+"""add lookup indexes
+
+Revision ID: 4c2e9a7d1f03
+Revises: b153a7a27458
+Create Date: 2026-10-18 12:20:41.512306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c2e9a7d1f03'
+down_revision = 'b153a7a27458'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # unique indexes need duplicate rows gone first, keep the oldest copy
+    op.execute('DELETE FROM tracklist WHERE id NOT IN (SELECT MIN(id) FROM tracklist GROUP BY playlist_id, track_id)')
+    op.execute('DELETE FROM playlist WHERE id NOT IN (SELECT MIN(id) FROM playlist GROUP BY playlist_id)')
+    op.execute('DELETE FROM track WHERE id NOT IN (SELECT MIN(id) FROM track GROUP BY track_id)')
+
+    op.create_index('ix_playlist_playlist_id', 'playlist', ['playlist_id'], unique=True)
+    op.create_index('ix_playlist_name_number', 'playlist', [sa.text('CAST(name AS INTEGER)')])
+    op.create_index('ix_track_track_id', 'track', ['track_id'], unique=True)
+    op.create_index('ix_tracklist_track_id', 'tracklist', ['track_id'])
+    op.create_index('uq_tracklist_playlist_id_track_id', 'tracklist', ['playlist_id', 'track_id'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_tracklist_playlist_id_track_id', table_name='tracklist')
+    op.drop_index('ix_tracklist_track_id', table_name='tracklist')
+    op.drop_index('ix_track_track_id', table_name='track')
+    op.drop_index('ix_playlist_name_number', table_name='playlist')
+    op.drop_index('ix_playlist_playlist_id', table_name='playlist')
@@ -0,0 +1,26 @@
+"""add playlist snapshot_id
+
+Revision ID: 7d3f2b9c6e41
+Revises: 4c2e9a7d1f03
+Create Date: 2026-10-18 13:02:17.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f2b9c6e41'
+down_revision = '4c2e9a7d1f03'
+branch_labels = None
+depends_on = None
+
+
+# plain ALTER TABLE rather than batch mode, so SQLite does not rebuild the
+# table and drop ix_playlist_name_number along the way
+def upgrade():
+    op.add_column('playlist', sa.Column('snapshot_id', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('playlist', 'snapshot_id')
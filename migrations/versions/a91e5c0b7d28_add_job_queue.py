@@ -0,0 +1,41 @@
+"""add job queue
+
+Revision ID: a91e5c0b7d28
+Revises: 7d3f2b9c6e41
+Create Date: 2026-10-18 13:31:52.880164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91e5c0b7d28'
+down_revision = '7d3f2b9c6e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # app.py runs db.create_all() on import, which may have created it already
+    if sa.inspect(op.get_bind()).has_table('job'):
+        return
+    op.create_table(
+        'job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('payload', sa.String(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('result', sa.String(), nullable=True),
+        sa.Column('worker', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_job_status', 'job', ['status'])
+
+
+def downgrade():
+    op.drop_index('ix_job_status', table_name='job')
+    op.drop_table('job')
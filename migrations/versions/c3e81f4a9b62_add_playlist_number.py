@@ -0,0 +1,31 @@
+"""add playlist number
+
+Revision ID: c3e81f4a9b62
+Revises: a91e5c0b7d28
+Create Date: 2026-10-18 14:05:36.417092
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e81f4a9b62'
+down_revision = 'a91e5c0b7d28'
+branch_labels = None
+depends_on = None
+
+
+# the stored number replaces the CAST(name AS INTEGER) expression index as the
+# homepage sort key; plain ALTER TABLE as in 7d3f2b9c6e41
+def upgrade():
+    op.add_column('playlist', sa.Column('number', sa.Integer(), nullable=True))
+    op.execute('UPDATE playlist SET number = CAST(name AS INTEGER)')
+    op.create_index('ix_playlist_number', 'playlist', ['number'])
+    op.drop_index('ix_playlist_name_number', table_name='playlist')
+
+
+def downgrade():
+    op.create_index('ix_playlist_name_number', 'playlist', [sa.text('CAST(name AS INTEGER)')])
+    op.drop_index('ix_playlist_number', table_name='playlist')
+    op.drop_column('playlist', 'number')
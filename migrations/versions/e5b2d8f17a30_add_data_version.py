@@ -0,0 +1,32 @@
+"""add data version
+
+Revision ID: e5b2d8f17a30
+Revises: c3e81f4a9b62
+Create Date: 2026-10-18 16:12:48.530917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b2d8f17a30'
+down_revision = 'c3e81f4a9b62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # app.py runs db.create_all() on import, which may have created it already
+    if sa.inspect(op.get_bind()).has_table('data_version'):
+        return
+    op.create_table(
+        'data_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('data_version')
@@ -0,0 +1,54 @@
+"""add recommendation table
+
+Revision ID: f0a4c6e9d215
+Revises: e5b2d8f17a30
+Create Date: 2026-10-18 17:03:11.274065
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f0a4c6e9d215'
+down_revision = 'e5b2d8f17a30'
+branch_labels = None
+depends_on = None
+
+
+# the table used to be created by pandas without an id column; its rows are
+# carried over into the declared table
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    legacy = inspector.has_table('recommendation')
+    if legacy:
+        # app.py runs db.create_all() on import, which may have created it already
+        if 'id' in [column['name'] for column in inspector.get_columns('recommendation')]:
+            return
+        op.rename_table('recommendation', 'recommendation_legacy')
+        op.execute('DROP INDEX IF EXISTS ix_recommendation_playlist_id')
+        op.execute('DROP INDEX IF EXISTS ix_recommendation_version')
+    op.create_table(
+        'recommendation',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('playlist_id', sa.String(length=50), nullable=False),
+        sa.Column('rank', sa.Integer(), nullable=False),
+        sa.Column('neighbor_id', sa.String(length=50), nullable=False),
+        sa.Column('score', sa.Float(), nullable=True),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_recommendation_playlist_id', 'recommendation', ['playlist_id'])
+    op.create_index('ix_recommendation_version', 'recommendation', ['version'])
+    if legacy:
+        op.execute(
+            'INSERT INTO recommendation (playlist_id, rank, neighbor_id, score, version) '
+            'SELECT playlist_id, rank, neighbor_id, score, version FROM recommendation_legacy ORDER BY playlist_id, rank'
+        )
+        op.drop_table('recommendation_legacy')
+
+
+def downgrade():
+    op.drop_index('ix_recommendation_version', table_name='recommendation')
+    op.drop_index('ix_recommendation_playlist_id', table_name='recommendation')
+    op.drop_table('recommendation')
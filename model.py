@@ -1,83 +1,311 @@
 import pandas as pd
 import numpy as np
 import sqlite3
-from sklearn.metrics.pairwise import cosine_similarity
+import threading
+import time
+from scipy import sparse
 from sklearn.decomposition import TruncatedSVD
+import data
+import neighbors
 
-db = sqlite3.connect('instance/playlists.db')
-artist = pd.read_sql_query("SELECT * FROM artist", db).set_index('id')
-playlist = pd.read_sql_query("SELECT * FROM playlist", db).set_index('id')
-track = pd.read_sql_query("SELECT * FROM track", db).set_index('id')
-tracklist = pd.read_sql_query("SELECT * FROM tracklist", db).set_index('id')
-
-def get_genres():
-    track_genres = track.merge(artist, left_on='artist_id', right_on='artist_id')[['track_id', 'genres']]
-    playlist_genres = tracklist.merge(track_genres, on='track_id', how='outer')
-    playlist_tracks = playlist_genres.groupby('playlist_id').agg(list)
-    playlist_tracks.dropna()
-    playlist_tracks['genres'] = playlist_tracks['genres'].apply(lambda genres: [genre.strip().replace("'", '') for genre in ",".join(genres).split(',') if isinstance(genre, str)])
-    genres = pd.merge(playlist_tracks, playlist[['name', 'playlist_id']], on="playlist_id", how="left")
-    return genres
+NUM_RECS = 5
+CHUNK_SIZE = 100000
+
+AUDIO_FEATURES = ['danceability', 'energy', 'loudness', 'mode', 'speechiness', 'acousticness', 'instrumentalness', 'valence', 'tempo']
+
+PLAYLIST_ROWS_QUERY = f"""
+    SELECT tracklist.playlist_id, track.artist_id, artist.genres, {', '.join('track.' + column for column in AUDIO_FEATURES)}
+    FROM tracklist
+    JOIN track ON track.track_id = tracklist.track_id
+    LEFT JOIN artist ON artist.artist_id = track.artist_id
+"""
+
+# exact median of one feature per playlist, computed inside SQLite: the
+# middle row, or the mean of the two middle rows, of each sorted partition
+MEDIAN_QUERY = """
+    SELECT playlist_id, AVG(value) AS {feature} FROM (
+        SELECT tracklist.playlist_id, track.{feature} AS value,
+            ROW_NUMBER() OVER (PARTITION BY tracklist.playlist_id ORDER BY track.{feature}) AS position,
+            COUNT(*) OVER (PARTITION BY tracklist.playlist_id) AS total
+        FROM tracklist
+        JOIN track ON track.track_id = tracklist.track_id
+        WHERE track.{feature} IS NOT NULL
+    )
+    WHERE position IN ((total + 1) / 2, (total + 2) / 2)
+    GROUP BY playlist_id
+"""
+
+# incrementally maintained feature state: one sparse genre-count row and one
+# audio-feature median row per playlist, loaded on first use and updated by
+# update_playlist()
+_lock = threading.RLock()
+_loaded = False
+genre_index = {}
+genre_names = []
+playlist_index = {}
+playlist_ids = []
+_genre_matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+_medians = np.empty((0, len(AUDIO_FEATURES)))
+
+# float32 copy of the medians for the spider chart, with the per-column
+# maxima it is normalized by; rebuilt whenever the medians change
+_audio_features = np.empty((0, len(AUDIO_FEATURES)), dtype=np.float32)
+_audio_maxima = np.zeros(len(AUDIO_FEATURES), dtype=np.float32)
+
+def genre_tokens(genres):
+    tokens = pd.Series(genres, dtype=object).str.split(',').explode()
+    tokens = tokens.str.strip().str.replace("'", '', regex=False)
+    return tokens[tokens.notna() & (tokens != '')]
+
+def vectorize_playlists(rows):
+    playlist_codes, playlists = pd.factorize(rows['playlist_id'])
+    artist_codes, artists = pd.factorize(rows['artist_id'])
+    _, first_rows = np.unique(artist_codes, return_index=True)
+    tokens = genre_tokens(rows['genres'].to_numpy()[first_rows])
+
+    for genre in tokens.unique():
+        if genre not in genre_index:
+            genre_index[genre] = len(genre_names)
+            genre_names.append(genre)
+    artist_genres = sparse.csr_matrix(
+        (np.ones(len(tokens), dtype=np.int32), (tokens.index.to_numpy(), tokens.map(genre_index).to_numpy())),
+        shape=(len(artists), len(genre_names))
+    )
+    playlist_artists = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (playlist_codes, artist_codes)),
+        shape=(len(playlists), len(artists))
+    )
+    genre_counts = (playlist_artists @ artist_genres).tocsr()
+    medians = rows[AUDIO_FEATURES].groupby(playlist_codes).median().to_numpy(dtype=float)
+    return list(playlists), genre_counts, medians
+
+def _merge_playlists(new_ids, genre_counts, medians):
+    global _genre_matrix, _medians, _audio_features, _audio_maxima, playlist_ids, playlist_index
+    _genre_matrix.resize((_genre_matrix.shape[0], len(genre_names)))
+    genre_counts.resize((genre_counts.shape[0], len(genre_names)))
+    ids = pd.Index(playlist_ids + new_ids)
+    keep = ~ids.duplicated(keep='last')
+    _genre_matrix = sparse.vstack([_genre_matrix, genre_counts]).tocsr()[keep]
+    _medians = np.vstack([_medians, medians])[keep]
+    _audio_features = _medians.astype(np.float32)
+    _audio_maxima = np.nanmax(np.abs(_audio_features), axis=0, initial=0)
+    playlist_ids = list(ids[keep])
+    playlist_index = {playlist_id: row for row, playlist_id in enumerate(playlist_ids)}
+
+def playlist_chunks(query, params=(), chunk_size=CHUNK_SIZE):
+    # rows of a query sorted by playlist_id, about chunk_size at a time and
+    # regrouped so no playlist is split across two chunks
+    carry = None
+    for rows in pd.read_sql_query(query, data.connection(), params=params, chunksize=chunk_size):
+        if rows.empty:
+            continue
+        if carry is not None:
+            rows = pd.concat([carry, rows], ignore_index=True)
+        ids = rows['playlist_id'].to_numpy()
+        earlier = np.flatnonzero(ids != ids[-1])
+        split = earlier[-1] + 1 if len(earlier) else 0
+        carry = rows.iloc[split:]
+        if split:
+            yield rows.iloc[:split]
+    if carry is not None and len(carry):
+        yield carry
+
+def _reset_features():
+    global _genre_matrix, _medians, _audio_features, _audio_maxima, genre_index, genre_names, playlist_ids, playlist_index
+    genre_index = {}
+    genre_names = []
+    playlist_index = {}
+    playlist_ids = []
+    _genre_matrix = sparse.csr_matrix((0, 0), dtype=np.int32)
+    _medians = np.empty((0, len(AUDIO_FEATURES)))
+    _audio_features = np.empty((0, len(AUDIO_FEATURES)), dtype=np.float32)
+    _audio_maxima = np.zeros(len(AUDIO_FEATURES), dtype=np.float32)
+
+def load_features(chunk_size=CHUNK_SIZE):
+    global _loaded
+    with _lock:
+        _reset_features()
+        query = PLAYLIST_ROWS_QUERY + " ORDER BY tracklist.playlist_id"
+        parts = [vectorize_playlists(rows) for rows in playlist_chunks(query, chunk_size=chunk_size)]
+        if parts:
+            new_ids, genre_counts, medians = zip(*parts)
+            for counts in genre_counts:
+                counts.resize((counts.shape[0], len(genre_names)))
+            _merge_playlists(sum(new_ids, []), sparse.vstack(genre_counts).tocsr(), np.vstack(medians))
+        _loaded = True
+
+def ensure_features():
+    with _lock:
+        if not _loaded:
+            load_features()
+
+def drop_features():
+    # reloaded from the database on next use
+    global _loaded
+    with _lock:
+        _loaded = False
+
+def update_playlist(playlist_id):
+    with _lock:
+        if not _loaded:
+            load_features()
+            return
+    rows = pd.read_sql_query(PLAYLIST_ROWS_QUERY + " WHERE tracklist.playlist_id = ?", data.connection(), params=(playlist_id,))
+    if rows.empty:
+        return
+    with _lock:
+        _merge_playlists(*vectorize_playlists(rows))
+
+def genre_matrix():
+    with _lock:
+        ensure_features()
+        return _genre_matrix
 
 def get_audio_features():
-    audio_features = track.drop(['name', 'artist', 'artist_id'], axis=1)
-    track_features = audio_features.merge(tracklist, on='track_id', how='outer').drop('track_id', axis=1)
-    playlist_features = track_features.groupby('playlist_id', sort=False).median()
-    playlist_features.drop(['key', 'liveness'], axis=1, inplace=True)
-    return playlist_features
-
-def get_genre_counts():
-    genres = get_genres()
-    all_genres = [genre for playlist_genres in genres['genres'] for genre in playlist_genres]
-    counted = [pd.Series(playlist_genres).value_counts().to_dict() for playlist_genres in genres['genres']]
-    genre_counts = genres.copy().drop('genres', axis=1).set_index('playlist_id')
-    genre_counts['counted'] = counted
-    gc = pd.json_normalize(genre_counts['counted'])
-    gc = gc.fillna(0)
-    gc = gc.astype(int)
-    gc = gc.set_index(genres['playlist_id'])
-    return gc
+    with _lock:
+        ensure_features()
+        return pd.DataFrame(_medians, index=pd.Index(playlist_ids, name='playlist_id'), columns=AUDIO_FEATURES)
+
+def playlist_audio_features(playlist_ids):
+    # normalized feature rows for a handful of playlists, read by index
+    with _lock:
+        ensure_features()
+        rows = [playlist_index.get(playlist_id) for playlist_id in playlist_ids]
+        features, maxima = _audio_features, _audio_maxima
+    scale = np.where(maxima == 0, np.inf, maxima)
+    empty = np.empty(0, dtype=np.float32)
+    return [empty if row is None else features[row] / scale for row in rows]
+
+def playlist_genres(playlist_id):
+    with _lock:
+        ensure_features()
+        row = playlist_index.get(playlist_id)
+        if row is None:
+            return []
+        return [genre_names[column] for column in _genre_matrix[row].indices]
+
+def sql_medians():
+    db = data.connection()
+    medians = [pd.read_sql_query(MEDIAN_QUERY.format(feature=feature), db, index_col='playlist_id') for feature in AUDIO_FEATURES]
+    return pd.concat(medians, axis=1).reindex(columns=AUDIO_FEATURES)
+
+def check_medians():
+    # largest difference between the in-memory medians and SQLite's
+    features = get_audio_features()
+    expected = sql_medians().reindex(features.index)
+    difference = np.abs(features.to_numpy() - expected.to_numpy())
+    return np.nanmax(difference, initial=0)
 
 def feature_svd(features, n):
     svd = TruncatedSVD(n_components=n)
     X_reduced = svd.fit_transform(features)
     return X_reduced
 
+def normalize_columns(X):
+    if sparse.issparse(X):
+        scale = abs(X).max(axis=0).toarray().ravel().astype(float)
+    else:
+        scale = np.nanmax(np.abs(X), axis=0, initial=0)
+    scale[scale == 0] = np.inf
+    if sparse.issparse(X):
+        return X @ sparse.diags(1 / scale)
+    return np.nan_to_num(X / scale)
+
 def get_features():
-    genre_counts = get_genre_counts()
-    playlist_features = get_audio_features()
-    features = genre_counts.join(playlist_features)
-    for column in features.columns:
-        features[column] = features[column] / features[column].abs().max()
-    features = features.fillna(0)
-    return features
+    with _lock:
+        ensure_features()
+        genre_counts = normalize_columns(genre_matrix())
+        playlist_features = normalize_columns(get_audio_features().to_numpy())
+        index = pd.Index(playlist_ids, name='playlist_id')
+    features = sparse.hstack([genre_counts, sparse.csr_matrix(playlist_features)]).tocsr()
+    return features, index
 
 def reduce_genres():
-    genre_counts = get_genre_counts()
-    X_reduced = feature_svd(genre_counts, 5)
+    X_reduced = feature_svd(genre_matrix(), 5)
 
-def update_similarities():
-    features = get_features()
+def update_similarities(k=NUM_RECS, approximate=False):
+    features, playlist_ids = get_features()
     X_reduced = feature_svd(features, 2)
 
-    similarity = cosine_similarity(X_reduced)
-    np.fill_diagonal(similarity, -np.inf)
+    if approximate:
+        top, scores = neighbors.lsh_top_k(X_reduced, k)
+    else:
+        top, scores = neighbors.top_k(X_reduced, k)
+    k = top.shape[1]
 
-    max_cosine_similarities = [np.argpartition(row, -5)[-5:] for row in similarity]
-    features = features.copy()
-    features['max_cosine_similarity'] = max_cosine_similarities
+    playlist_ids = playlist_ids.to_numpy()
+    rec = pd.DataFrame({
+        'playlist_id': np.repeat(playlist_ids, k),
+        'rank': np.tile(np.arange(k), len(playlist_ids)),
+        'neighbor_id': playlist_ids[top.ravel()],
+        'score': scores.ravel(),
+    })
+    return rec
 
-    rec = pd.DataFrame(features['max_cosine_similarity'])
-    rec = pd.merge(rec, playlist[['playlist_id', 'name']], on='playlist_id', how='left').set_index('name')
+def check_recall(k=NUM_RECS):
+    features, playlist_ids = get_features()
+    X_reduced = feature_svd(features, 2)
+    exact, _ = neighbors.top_k(X_reduced, k)
+    approximate, _ = neighbors.lsh_top_k(X_reduced, k)
+    return neighbors.recall(exact, approximate)
 
-    rec['rec'] = rec['max_cosine_similarity'].apply(lambda x: [rec.iloc[i].name for i in x])
-    rec.drop('max_cosine_similarity', axis=1, inplace=True)
-    rec.reset_index()
+# recommendation store: rebuilt by build_recs() in the worker, served from
+# _recs; a new stored version also drops the feature state, which another
+# process has changed
+_recs = None
+_rec_version = None
+_recs_lock = threading.Lock()
 
-    return rec
+def build_recs(k=NUM_RECS, approximate=False):
+    global _recs, _rec_version
+    rec = update_similarities(k, approximate)
+    version = int(time.time() * 1000)
+    rec['version'] = version
+    rows = zip(*(rec[column].tolist() for column in ['playlist_id', 'rank', 'neighbor_id', 'score', 'version']))
+    # one transaction, so readers see either the old or the new build
+    with data.connection() as db:
+        db.execute("DELETE FROM recommendation")
+        db.executemany("INSERT INTO recommendation (playlist_id, rank, neighbor_id, score, version) VALUES (?, ?, ?, ?, ?)", rows)
+    with _recs_lock:
+        # built from this process's features, so keep them
+        _recs = None
+        _rec_version = version
+    return version
+
+def stored_rec_version():
+    try:
+        with data.connection() as db:
+            return db.execute("SELECT MAX(version) FROM recommendation").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def load_recs():
+    # empty until the worker's first rebuild
+    global _recs, _rec_version
+    version = stored_rec_version()
+    with _recs_lock:
+        if version != _rec_version:
+            drop_features()
+            _recs = None
+            _rec_version = version
+        if version is None:
+            return {}
+        if _recs is None:
+            with data.connection() as db:
+                rec = pd.read_sql_query("SELECT playlist_id, neighbor_id, score FROM recommendation ORDER BY playlist_id, rank", db)
+            _recs = {
+                playlist_id: list(zip(group['neighbor_id'], group['score']))
+                for playlist_id, group in rec.groupby('playlist_id', sort=False)
+            }
+        return _recs
+
+def rec_version():
+    load_recs()
+    return _rec_version
 
 def get_recs(playlist_id):
-    update_similarities()
-    return rec_df.loc[rec_df['playlist_id'] == playlist_id, 'rec'].values[0]
+    return [neighbor_id for neighbor_id, score in load_recs().get(playlist_id, [])]
 
-rec_df = update_similarities()
\ No newline at end of file
+def get_scored_recs(playlist_ids, k=NUM_RECS):
+    recs = load_recs()
+    return {playlist_id: recs.get(playlist_id, [])[:k] for playlist_id in playlist_ids}
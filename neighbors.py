@@ -0,0 +1,87 @@
+import numpy as np
+
+BLOCK_SIZE = 1024
+BUCKET_SIZE = 64
+WINDOW = 16
+PAIR_BLOCK = 1 << 18
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=float)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return X / norms
+
+def _sorted_top_k(scores, k):
+    top = np.argpartition(scores, -k, axis=1)[:, -k:]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def top_k(X, k, rows=None, block_size=BLOCK_SIZE):
+    # exact cosine top-k, computed block by block so only block_size x n
+    # similarities are held at once
+    X = normalize_rows(X)
+    n = len(X)
+    rows = np.arange(n) if rows is None else np.asarray(rows)
+    k = min(k, n - 1)
+    indices = np.empty((len(rows), k), dtype=np.int64)
+    scores = np.empty((len(rows), k))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        similarity = X[block] @ X.T
+        similarity[np.arange(len(block)), block] = -np.inf
+        indices[start:start + len(block)], scores[start:start + len(block)] = _sorted_top_k(similarity, k)
+    return indices, scores
+
+def lsh_top_k(X, k, n_tables=4, n_bits=None, window=WINDOW, seed=0):
+    # approximate cosine top-k: each table sorts rows by random hyperplane
+    # hash, then by a random projection, and pairs every row with the
+    # window rows either side of it; candidates are scored exactly, with an
+    # exact fallback for rows that end up with too few
+    X = normalize_rows(X)
+    n, dim = X.shape
+    k = min(k, n - 1)
+    if n_bits is None:
+        n_bits = max(1, int(np.log2(max(n / BUCKET_SIZE, 1))))
+    rng = np.random.default_rng(seed)
+
+    pairs = []
+    for _ in range(n_tables):
+        planes = rng.standard_normal((dim, n_bits))
+        codes = (X @ planes > 0) @ (1 << np.arange(n_bits))
+        position = X @ rng.standard_normal(dim)
+        order = np.lexsort((position, codes))
+        for offset in range(1, min(window, n - 1) + 1):
+            left, right = order[:-offset], order[offset:]
+            pairs.append(left * n + right)
+            pairs.append(right * n + left)
+    pairs = np.unique(np.concatenate(pairs)) if pairs else np.empty(0, dtype=np.int64)
+    left, right = pairs // n, pairs % n
+    keep = left != right
+    left, right = left[keep], right[keep]
+    pair_scores = np.concatenate([
+        np.einsum('ij,ij->i', X[left[start:start + PAIR_BLOCK]], X[right[start:start + PAIR_BLOCK]])
+        for start in range(0, len(left), PAIR_BLOCK)
+    ]) if len(left) else np.empty(0)
+
+    order = np.lexsort((-pair_scores, left))
+    left, right, pair_scores = left[order], right[order], pair_scores[order]
+    starts = np.searchsorted(left, np.arange(n))
+    counts = np.bincount(left, minlength=n)
+    rank = np.arange(len(left)) - starts[left]
+    keep = rank < k
+
+    indices = np.empty((n, k), dtype=np.int64)
+    scores = np.empty((n, k))
+    indices[left[keep], rank[keep]] = right[keep]
+    scores[left[keep], rank[keep]] = pair_scores[keep]
+
+    short = np.flatnonzero(counts < k)
+    if len(short):
+        indices[short], scores[short] = top_k(X, k, rows=short)
+    return indices, scores
+
+def recall(exact, approximate):
+    # mean fraction of the exact neighbors recovered per row
+    hits = [len(np.intersect1d(e, a)) for e, a in zip(exact, approximate)]
+    return np.sum(hits) / exact.size if exact.size else 1.0
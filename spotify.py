@@ -0,0 +1,213 @@
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_URL = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com/v1')
+ACCOUNTS_URL = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+MAX_WORKERS = int(os.getenv('SPOTIFY_MAX_WORKERS', 8))
+MAX_RETRIES = 5
+TIMEOUT = 30
+TOKEN_CACHE = os.getenv('SPOTIFY_TOKEN_CACHE', 'instance/spotify_tokens.json')
+REFRESH_MARGIN = 60
+
+# one keep-alive pool shared by every thread, with at most MAX_WORKERS
+# requests in flight
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS))
+_slots = threading.BoundedSemaphore(MAX_WORKERS)
+_retry_lock = threading.Lock()
+_retry_at = 0
+
+def api_url(url):
+    if url.startswith('http'):
+        return url
+    return f"{API_URL}{url}"
+
+# tokens live in TOKEN_CACHE so the web process, the scheduler and any
+# worker share one login; they are refreshed shortly before they expire
+_tokens = None
+_token_lock = threading.Lock()
+
+def _read_tokens():
+    if not os.path.exists(TOKEN_CACHE):
+        return {}
+    with open(TOKEN_CACHE, 'r') as file:
+        return json.load(file)
+
+def _write_tokens(tokens):
+    os.makedirs(os.path.dirname(TOKEN_CACHE) or '.', exist_ok=True)
+    tmp_path = f"{TOKEN_CACHE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as file:
+        json.dump(tokens, file)
+    os.replace(tmp_path, TOKEN_CACHE)
+
+def _store_tokens(tokens, previous=None):
+    tokens = dict(tokens)
+    if previous and not tokens.get('refresh_token'):
+        tokens['refresh_token'] = previous.get('refresh_token')
+    tokens['expires_at'] = int(time.time()) + int(tokens.get('expires_in', 3600))
+    _write_tokens(tokens)
+    return tokens
+
+def _is_fresh(tokens):
+    return bool(tokens.get('access_token')) and tokens.get('expires_at', 0) - REFRESH_MARGIN > time.time()
+
+def set_tokens(tokens):
+    global _tokens
+    with _token_lock:
+        _tokens = _store_tokens(tokens)
+    return _tokens['access_token']
+
+def _refresh_locked():
+    global _tokens
+    cached = _read_tokens()
+    if _is_fresh(cached) and cached.get('access_token') != _tokens.get('access_token'):
+        _tokens = cached
+        return _tokens['access_token']
+
+    refresh_token = _tokens.get('refresh_token') or cached.get('refresh_token')
+    if not refresh_token:
+        return None
+    token_data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+        'client_id': os.getenv('CLIENT_ID'),
+        'client_secret': os.getenv('CLIENT_SECRET'),
+    }
+    response = post(f"{ACCOUNTS_URL}/api/token", data=token_data)
+    if response.status_code != 200:
+        print(f"Error refreshing access token: {response.status_code}")
+        return None
+    _tokens = _store_tokens(response.json(), {'refresh_token': refresh_token})
+    return _tokens['access_token']
+
+def access_token():
+    global _tokens
+    with _token_lock:
+        if _tokens is None:
+            _tokens = _read_tokens()
+        if _is_fresh(_tokens):
+            return _tokens['access_token']
+        return _refresh_locked()
+
+def refresh_access_token(stale_token=None):
+    global _tokens
+    with _token_lock:
+        if _tokens is None:
+            _tokens = _read_tokens()
+        if stale_token and _tokens.get('access_token') != stale_token and _is_fresh(_tokens):
+            return _tokens['access_token']
+        return _refresh_locked()
+
+def _wait_for_rate_limit():
+    delay = _retry_at - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
+def _back_off(response, attempt):
+    global _retry_at
+    delay = float(response.headers.get('Retry-After', 2 ** attempt))
+    with _retry_lock:
+        _retry_at = max(_retry_at, time.monotonic() + delay)
+
+def request(method, url, auth=None, **kwargs):
+    url = api_url(url)
+    if auth is None:
+        auth = url.startswith(API_URL)
+    headers = dict(kwargs.pop('headers', None) or {})
+    token = None
+    if auth:
+        token = access_token()
+        headers['Authorization'] = f'Bearer {token}'
+    kwargs.setdefault('timeout', TIMEOUT)
+
+    refreshed = False
+    for attempt in range(MAX_RETRIES):
+        _wait_for_rate_limit()
+        with _slots:
+            response = session.request(method, url, headers=headers, **kwargs)
+        if response.status_code == 401 and auth and not refreshed:
+            refreshed = True
+            token = refresh_access_token(token)
+            if token:
+                headers['Authorization'] = f'Bearer {token}'
+                continue
+            return response
+        if response.status_code == 429 or response.status_code >= 500:
+            _back_off(response, attempt)
+            continue
+        return response
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def fetch_all(fn, items):
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return list(executor.map(fn, items))
+
+def paginate(url, **kwargs):
+    # yields one page of items at a time, fetching the next page while the
+    # caller works on the current one
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(get, url, **kwargs)
+        while future is not None:
+            response = future.result()
+            response.raise_for_status()
+            data = response.json()
+            next_url = data.get('next')
+            future = executor.submit(get, next_url) if next_url else None
+            yield data.get('items', [])
+
+def paginate_all(urls, errors=None):
+    # pages from several paginated urls, as (key, items) in per-url order;
+    # at most MAX_WORKERS pages are buffered at once. With an errors dict, a
+    # url whose pages fail is recorded there by key instead of raising
+    pages = queue.Queue(maxsize=MAX_WORKERS)
+    stop = threading.Event()
+
+    def produce(key, url):
+        try:
+            for items in paginate(url):
+                while not stop.is_set():
+                    try:
+                        pages.put((key, items), timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            if errors is None:
+                raise
+            errors[key] = e
+        finally:
+            pages.put((key, None))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(produce, key, url) for key, url in urls.items()]
+        remaining = len(futures)
+        try:
+            while remaining:
+                key, items = pages.get()
+                if items is None:
+                    remaining -= 1
+                    continue
+                yield key, items
+        finally:
+            stop.set()
+            while remaining:
+                if pages.get()[1] is None:
+                    remaining -= 1
+    for future in futures:
+        future.result()
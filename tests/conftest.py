@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the app binds its database at import, so every test shares one temporary
+# file and empties it between tests
+os.environ['PLAYLISTS_DB'] = os.path.join(tempfile.mkdtemp(), 'playlists.db')
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def empty_db(app_module):
+    import model
+    with app_module.app.app_context():
+        db = app_module.db
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        model.drop_features()
+        model._recs = None
+        model._rec_version = None
+        app_module.get_playlist_tracks.cache_clear()
+        app_module.index_page.cache_clear()
+        yield db
+        db.session.remove()
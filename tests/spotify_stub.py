@@ -0,0 +1,134 @@
+# a small stand-in for the Spotify Web API and accounts service. Point
+# SPOTIFY_API_URL at <url>/v1 and SPOTIFY_ACCOUNTS_URL at <url>:
+#
+#   python tests/spotify_stub.py 8765
+import json
+import re
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+PLAYLIST_TRACKS = 130
+
+
+def playlist_json(index, snapshot='snap'):
+    return {
+        'id': f'sp{index}',
+        'name': f'{index + 100} stub tunes',
+        'external_urls': {'spotify': f'https://open.spotify.com/playlist/sp{index}'},
+        'images': [{'url': f'https://image-cdn-ak.spotifycdn.com/image/{index}'}],
+        'snapshot_id': f'{snapshot}{index}',
+    }
+
+
+def track_json(playlist, position):
+    return {'track': {
+        'id': f'st{playlist * 7 + position}',
+        'name': f'song {position}',
+        'artists': [{'id': f'sa{(playlist * 7 + position) % 40}', 'name': 'stub artist'}],
+    }}
+
+
+class StubSpotify:
+    def __init__(self, playlists=45, port=0):
+        self.playlists = playlists
+        self.access_token = 'token-1'
+        self.rate_limit = 0
+        self.retry_after = 1
+        self.failing = set()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self.handler())
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def paths(self, method='GET'):
+        return [path for verb, path in self.requests if verb == method]
+
+    def page(self, base, query, total, limit, item):
+        offset = int(query.get('offset', [0])[0])
+        limit = int(query.get('limit', [limit])[0])
+        next_url = f'{self.url}{base}?offset={offset + limit}&limit={limit}' if offset + limit < total else None
+        items = [item(position) for position in range(offset, min(offset + limit, total))]
+        return {'items': items, 'next': next_url, 'total': total}
+
+    def get(self, path, query, headers):
+        if headers.get('Authorization') != f'Bearer {self.access_token}':
+            return 401, {'error': {'status': 401, 'message': 'The access token expired'}}, {}
+        with self.lock:
+            if self.rate_limit:
+                self.rate_limit -= 1
+                return 429, {}, {'Retry-After': str(self.retry_after)}
+        if path == '/v1/me/playlists':
+            return 200, self.page(path, query, self.playlists, 50, playlist_json), {}
+        match = re.fullmatch(r'/v1/playlists/sp(\d+)/tracks', path)
+        if match:
+            playlist = int(match.group(1))
+            if f'sp{playlist}' in self.failing and 'offset' in query:
+                return 404, {'error': {'status': 404, 'message': 'Not found'}}, {}
+            return 200, self.page(path, query, PLAYLIST_TRACKS, 100, lambda position: track_json(playlist, position)), {}
+        match = re.fullmatch(r'/v1/playlists/sp(\d+)', path)
+        if match:
+            return 200, playlist_json(int(match.group(1))), {}
+        if path == '/v1/artists':
+            artists = [{'id': artist_id, 'name': f'Artist {artist_id}', 'genres': ['pop', 'indie pop']} for artist_id in query['ids'][0].split(',')]
+            return 200, {'artists': artists}, {}
+        return 404, {'error': {'status': 404, 'message': path}}, {}
+
+    def refresh(self, form):
+        if form.get('grant_type') != ['refresh_token'] or not form.get('refresh_token'):
+            return 400, {'error': 'invalid_grant'}, {}
+        with self.lock:
+            number = int(self.access_token.rsplit('-', 1)[1]) + 1
+            self.access_token = f'token-{number}'
+        return 200, {'access_token': self.access_token, 'token_type': 'Bearer', 'expires_in': 3600}, {}
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, status, body, headers):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.requests.append(('GET', self.path))
+                self.respond(*stub.get(url.path, parse_qs(url.query), self.headers))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                stub.requests.append(('POST', self.path))
+                if self.path == '/api/token':
+                    self.respond(*stub.refresh(parse_qs(body)))
+                else:
+                    self.respond(404, {'error': self.path}, {})
+
+        return Handler
+
+
+if __name__ == '__main__':
+    stub = StubSpotify(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f'SPOTIFY_API_URL={stub.url}/v1')
+    print(f'SPOTIFY_ACCOUNTS_URL={stub.url}')
+    print(f'access token: {stub.access_token}')
+    stub.server.serve_forever()
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def artist_db(app_module, empty_db):
+    app = app_module
+    empty_db.session.add(app.Artist(artist_id='a1', name='Artist One', genres='pop'))
+    empty_db.session.add(app.Artist(artist_id='a2', name='Artist Two', genres='rock'))
+    for i in range(3):
+        empty_db.session.add(app.Playlist(playlist_id=f'p{i}', name=f'{i} playlist', number=i, url='u', image='i'))
+        empty_db.session.add(app.Track(track_id=f't{i}', name=f'song {i}', artist='Artist One', artist_id='a1'))
+        empty_db.session.execute(app.tracklist.insert().values(playlist_id=f'p{i}', track_id=f't{i}'))
+    empty_db.session.add(app.Track(track_id='t9', name='lonely song', artist='Artist Two', artist_id='a2'))
+    empty_db.session.commit()
+    return empty_db
+
+
+@pytest.fixture
+def count_queries(app_module, artist_db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app_module.app.app_context():
+        engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def test_artist_page_is_one_query(app_module, count_queries):
+    response = app_module.app.test_client().get('/artist/a1')
+    assert response.status_code == 200
+    assert b'2 playlist' in response.data
+    assert len(count_queries) == 1
+
+
+def test_artist_without_playlists_is_one_query(app_module, count_queries):
+    response = app_module.app.test_client().get('/artist/a2')
+    assert response.status_code == 200
+    assert len(count_queries) == 1
+
+
+def test_unknown_artist_is_not_found(app_module, count_queries):
+    response = app_module.app.test_client().get('/artist/nope')
+    assert response.status_code == 404
+    assert len(count_queries) == 1
@@ -0,0 +1,84 @@
+from collections import Counter
+import numpy as np
+import pandas as pd
+import pytest
+import data
+import model
+
+GENRES = ['pop', 'rock', "rock n' roll", 'jazz', 'house']
+
+
+@pytest.fixture
+def feature_db(app_module, empty_db):
+    rng = np.random.default_rng(7)
+    artists = [
+        {'artist_id': f'a{i}', 'name': f'artist {i}', 'genres': ', '.join(rng.choice(GENRES, size=i % 3, replace=False))}
+        for i in range(8)
+    ]
+    tracks = []
+    for i in range(60):
+        track = {'track_id': f't{i}', 'name': f'song {i}', 'artist': 'artist', 'artist_id': f'a{i % 8}'}
+        for feature in model.AUDIO_FEATURES:
+            track[feature] = None if rng.random() < 0.2 else float(rng.normal(size=1)[0])
+        tracks.append(track)
+    # p00 has no audio features at all, p01 a single track
+    tracklist = [{'playlist_id': 'p00', 'track_id': 't0'}, {'playlist_id': 'p01', 'track_id': 't1'}]
+    for feature in model.AUDIO_FEATURES:
+        tracks[0][feature] = None
+    for p in range(2, 25):
+        for track_id in rng.choice(60, size=rng.integers(2, 12), replace=False):
+            tracklist.append({'playlist_id': f'p{p:02d}', 'track_id': f't{track_id}'})
+    empty_db.session.execute(app_module.Artist.__table__.insert(), artists)
+    empty_db.session.execute(app_module.Track.__table__.insert(), tracks)
+    empty_db.session.execute(app_module.tracklist.insert(), tracklist)
+    empty_db.session.commit()
+    return empty_db
+
+
+def pandas_medians():
+    # the original feature pipeline: merge every track onto the tracklist and
+    # take the per-playlist median
+    db = data.connection()
+    track = pd.read_sql_query("SELECT * FROM track", db)
+    tracklist = pd.read_sql_query("SELECT playlist_id, track_id FROM tracklist", db)
+    features = track[['track_id'] + model.AUDIO_FEATURES].merge(tracklist, on='track_id').drop('track_id', axis=1)
+    return features.groupby('playlist_id').median()
+
+
+def pandas_genre_counts():
+    db = data.connection()
+    rows = pd.read_sql_query(
+        "SELECT tracklist.playlist_id, artist.genres FROM tracklist"
+        " JOIN track ON track.track_id = tracklist.track_id"
+        " JOIN artist ON artist.artist_id = track.artist_id", db)
+    counts = {}
+    for playlist_id, genres in zip(rows['playlist_id'], rows['genres']):
+        tokens = [genre.strip().replace("'", '') for genre in genres.split(',')]
+        counts.setdefault(playlist_id, Counter()).update(token for token in tokens if token)
+    return counts
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, model.CHUNK_SIZE])
+def test_chunked_features_match_pandas(feature_db, chunk_size):
+    model.load_features(chunk_size=chunk_size)
+    features = model.get_audio_features()
+    expected = pandas_medians()
+    assert sorted(features.index) == sorted(expected.index)
+    np.testing.assert_allclose(features.loc[expected.index].to_numpy(), expected.to_numpy(), equal_nan=True)
+    assert features.loc['p00'].isna().all()
+
+    for playlist_id, counts in pandas_genre_counts().items():
+        row = model._genre_matrix[model.playlist_index[playlist_id]]
+        found = {model.genre_names[column]: count for column, count in zip(row.indices, row.data)}
+        assert found == dict(counts)
+
+
+def test_features_match_sql_medians(feature_db):
+    model.load_features(chunk_size=5)
+    assert model.check_medians() < 1e-9
+
+
+def test_empty_database_loads(app_module, empty_db):
+    model.load_features(chunk_size=7)
+    assert model.get_audio_features().empty
+    assert model.playlist_genres('p00') == []
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+
+
+def rebuild_jobs(app_module):
+    return app_module.Job.query.filter_by(kind='rebuild').count()
+
+
+def test_rec_version_requests_one_rebuild(app_module, empty_db):
+    assert app_module.rec_version() is None
+    assert app_module.rec_version() is None
+    assert rebuild_jobs(app_module) == 1
+
+
+def test_failed_rebuild_is_not_requested_again(app_module, empty_db):
+    job = app_module.Job(kind='rebuild', status='failed', finished_at=datetime.utcnow())
+    empty_db.session.add(job)
+    empty_db.session.commit()
+    assert app_module.rec_version() is None
+    assert rebuild_jobs(app_module) == 1
+
+
+def test_old_failed_rebuild_is_retried(app_module, empty_db):
+    finished_at = datetime.utcnow() - app_module.JOB_TIMEOUT - timedelta(minutes=1)
+    empty_db.session.add(app_module.Job(kind='rebuild', status='failed', finished_at=finished_at))
+    empty_db.session.commit()
+    assert app_module.rec_version() is None
+    assert rebuild_jobs(app_module) == 2
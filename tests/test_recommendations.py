@@ -0,0 +1,39 @@
+import pytest
+
+
+@pytest.fixture
+def recs_db(app_module, empty_db):
+    app = app_module
+    for i in range(3):
+        empty_db.session.add(app.Playlist(playlist_id=f'p{i}', name=f'{i} playlist', number=i, url='u', image='i'))
+    empty_db.session.add(app.Recommendation(playlist_id='p0', rank=0, neighbor_id='p1', score=0.9, version=1000))
+    empty_db.session.add(app.Recommendation(playlist_id='p0', rank=1, neighbor_id='p2', score=0.5, version=1000))
+    empty_db.session.commit()
+    return empty_db
+
+
+def test_recommendations_are_revalidated(app_module, recs_db):
+    client = app_module.app.test_client()
+    response = client.get('/recommendations?id=p0')
+    assert response.status_code == 200
+    assert [neighbor['name'] for neighbor in response.json['recommendations'][0]['neighbors']] == ['1 playlist', '2 playlist']
+    etag = response.headers['ETag']
+    assert client.get('/recommendations?id=p0', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_renamed_playlist_changes_the_etag(app_module, recs_db):
+    client = app_module.app.test_client()
+    etag = client.get('/recommendations?id=p0').headers['ETag']
+    app_module.Playlist.query.filter_by(playlist_id='p1').one().name = '1 renamed'
+    recs_db.session.commit()
+    app_module.bump_data_version()
+    response = client.get('/recommendations?id=p0', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.json['recommendations'][0]['neighbors'][0]['name'] == '1 renamed'
+
+
+def test_recommendations_without_a_build_are_not_cached(app_module, empty_db):
+    response = app_module.app.test_client().get('/recommendations?id=p0')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert 'ETag' not in response.headers
@@ -0,0 +1,70 @@
+import json
+import time
+import pytest
+import spotify
+from spotify_stub import StubSpotify, PLAYLIST_TRACKS
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    stub = StubSpotify().start()
+    monkeypatch.setattr(spotify, 'API_URL', f'{stub.url}/v1')
+    monkeypatch.setattr(spotify, 'ACCOUNTS_URL', stub.url)
+    monkeypatch.setattr(spotify, 'TOKEN_CACHE', str(tmp_path / 'tokens.json'))
+    monkeypatch.setattr(spotify, '_tokens', None)
+    monkeypatch.setattr(spotify, '_retry_at', 0)
+    spotify.set_tokens({'access_token': stub.access_token, 'refresh_token': 'refresh-1', 'expires_in': 3600})
+    yield stub
+    stub.stop()
+
+
+def test_paginate_follows_next(stub):
+    pages = list(spotify.paginate('/me/playlists?limit=20'))
+    assert [len(items) for items in pages] == [20, 20, 5]
+    assert [item['id'] for items in pages for item in items] == [f'sp{i}' for i in range(45)]
+
+
+def test_paginate_all_keeps_per_url_order(stub):
+    urls = {f'sp{i}': f'/playlists/sp{i}/tracks?limit=50' for i in range(4)}
+    tracks = {key: [] for key in urls}
+    for key, items in spotify.paginate_all(urls):
+        tracks[key].extend(item['track']['name'] for item in items)
+    for key in urls:
+        assert tracks[key] == [f'song {j}' for j in range(PLAYLIST_TRACKS)]
+
+
+def test_paginate_all_records_failed_urls(stub):
+    stub.failing.add('sp1')
+    errors = {}
+    keys = [key for key, items in spotify.paginate_all({'sp0': '/playlists/sp0/tracks', 'sp1': '/playlists/sp1/tracks'}, errors)]
+    assert list(errors) == ['sp1']
+    assert keys.count('sp0') == 2
+
+
+def test_rate_limit_waits_for_retry_after(stub):
+    stub.rate_limit = 1
+    started = time.monotonic()
+    response = spotify.get('/playlists/sp3')
+    assert response.status_code == 200
+    assert response.json()['id'] == 'sp3'
+    assert time.monotonic() - started >= stub.retry_after
+    assert stub.paths().count('/v1/playlists/sp3') == 2
+
+
+def test_expired_token_is_refreshed_once(stub):
+    stub.access_token = 'token-5'
+    response = spotify.get('/playlists/sp3')
+    assert response.status_code == 200
+    assert stub.paths('POST') == ['/api/token']
+    assert spotify.access_token() == 'token-6'
+    with open(spotify.TOKEN_CACHE) as file:
+        tokens = json.load(file)
+    assert tokens['access_token'] == 'token-6'
+    assert tokens['refresh_token'] == 'refresh-1'
+
+
+def test_failed_refresh_returns_the_401(stub, monkeypatch):
+    stub.access_token = 'token-5'
+    monkeypatch.setattr(spotify, '_tokens', {'access_token': 'token-1', 'expires_at': time.time() + 3600})
+    monkeypatch.setattr(stub, 'refresh', lambda form: (400, {'error': 'invalid_grant'}, {}))
+    assert spotify.get('/playlists/sp3').status_code == 401
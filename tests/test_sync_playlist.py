@@ -0,0 +1,91 @@
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.status_code = 200
+
+    def json(self):
+        return self.data
+
+
+def playlist_json(playlist_id, image):
+    return {
+        'id': playlist_id,
+        'name': '9 cool tunes',
+        'external_urls': {'spotify': f'https://open.spotify.com/playlist/{playlist_id}'},
+        'images': [{'url': image}],
+        'snapshot_id': 'snap1',
+    }
+
+
+@pytest.fixture
+def fake_spotify(app_module, empty_db, monkeypatch):
+    playlists = {}
+    items = [{'track': {'id': 't1', 'name': 'song', 'artists': [{'id': 'a1', 'name': 'Artist One'}]}}]
+
+    def get(url, **kwargs):
+        if url.startswith('/playlists/'):
+            return FakeResponse(playlists[url.rsplit('/', 1)[1]])
+        if url == '/artists':
+            return FakeResponse({'artists': [{'id': 'a1', 'name': 'Artist One', 'genres': ['pop']}]})
+        raise AssertionError(url)
+
+    def paginate_all(urls, errors=None):
+        for playlist_id in urls:
+            yield playlist_id, items
+
+    spotify = app_module.spotify
+    monkeypatch.setattr(spotify, 'access_token', lambda: 'tok')
+    monkeypatch.setattr(spotify, 'get', get)
+    monkeypatch.setattr(spotify, 'paginate_all', paginate_all)
+    return playlists
+
+
+def tracklist_rows(app_module, playlist_id):
+    db = app_module.db
+    tracklist = app_module.tracklist
+    return db.session.query(tracklist).filter(tracklist.c.playlist_id == playlist_id).count()
+
+
+def test_sync_playlist_ingests_admitted_playlist(app_module, fake_spotify):
+    fake_spotify['sp1'] = playlist_json('sp1', 'https://image-cdn-ak.spotifycdn.com/image/1')
+    assert app_module.sync_playlist('sp1') == 1
+    assert app_module.Playlist.query.filter_by(playlist_id='sp1').one().snapshot_id == 'snap1'
+    assert tracklist_rows(app_module, 'sp1') == 1
+
+
+def test_sync_playlist_skips_playlist_that_was_not_admitted(app_module, fake_spotify):
+    fake_spotify['sp9'] = playlist_json('sp9', 'https://mosaic.scdn.co/640/abc')
+    assert app_module.sync_playlist('sp9') == 0
+    assert app_module.Playlist.query.filter_by(playlist_id='sp9').first() is None
+    assert tracklist_rows(app_module, 'sp9') == 0
+
+
+def test_sync_playlists_ignores_unknown_playlists(app_module, fake_spotify):
+    assert app_module.sync_playlists({'sp9': 'snap1'}) == []
+    assert tracklist_rows(app_module, 'sp9') == 0
+
+
+def test_sync_playlist_refreshes_changed_playlist(app_module, fake_spotify):
+    fake_spotify['sp1'] = playlist_json('sp1', 'https://image-cdn-ak.spotifycdn.com/image/1')
+    app_module.sync_playlist('sp1')
+    fake_spotify['sp1'] = dict(playlist_json('sp1', 'https://image-cdn-ak.spotifycdn.com/image/2'), name='12 new name', snapshot_id='snap2')
+    assert app_module.sync_playlist('sp1') == 1
+    playlist = app_module.Playlist.query.filter_by(playlist_id='sp1').one()
+    assert (playlist.name, playlist.number, playlist.image, playlist.snapshot_id) == ('12 new name', 12, 'https://image-cdn-ak.spotifycdn.com/image/2', 'snap2')
+
+
+def test_sync_playlist_keeps_image_that_fails_the_check(app_module, fake_spotify):
+    fake_spotify['sp1'] = playlist_json('sp1', 'https://image-cdn-ak.spotifycdn.com/image/1')
+    app_module.sync_playlist('sp1')
+    fake_spotify['sp1'] = dict(playlist_json('sp1', 'https://mosaic.scdn.co/640/abc'), snapshot_id='snap2')
+    assert app_module.sync_playlist('sp1') == 1
+    assert app_module.Playlist.query.filter_by(playlist_id='sp1').one().image == 'https://image-cdn-ak.spotifycdn.com/image/1'
+
+
+def test_sync_playlist_skips_unchanged_snapshot(app_module, fake_spotify):
+    fake_spotify['sp1'] = playlist_json('sp1', 'https://image-cdn-ak.spotifycdn.com/image/1')
+    app_module.sync_playlist('sp1')
+    assert app_module.sync_playlist('sp1') == 0
@@ -0,0 +1,33 @@
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from app import app, db, Job, claim_job, enqueue_job, requeue_stale_jobs, run_job
+
+POLL_INTERVAL = int(os.getenv('WORKER_POLL_INTERVAL', 5))
+UPDATE_INTERVAL = timedelta(days=1)
+
+def schedule_update():
+    last_update = Job.query.filter_by(kind='ingest').order_by(Job.created_at.desc()).first()
+    if last_update is None or last_update.created_at < datetime.utcnow() - UPDATE_INTERVAL:
+        enqueue_job('ingest')
+
+def work(once=False):
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    with app.app_context():
+        requeue_stale_jobs()
+        while True:
+            schedule_update()
+            job = claim_job(worker)
+            if job is not None:
+                print(f"running job {job.id} '{job.kind}'")
+                job = run_job(job)
+                print(f"job {job.id} '{job.kind}' {job.status}")
+                db.session.remove()
+                continue
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+
+if __name__ == "__main__":
+    work()